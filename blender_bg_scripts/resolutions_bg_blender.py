@@ -69,6 +69,7 @@ def generate_lower_resolutions(data) -> list[dict]:
       os.mkdir(tex_dir_abs)
 
     reduced_textures_filessize = 0
+    filepath_counts = paths.get_image_filepath_counts()
     for i in bpy.data.images:
       if i.name not in ['Render Result', 'Viewer Node']:
         print(f'scaling image {i.name} ({i.size[0]}x{i.size[1]})')
@@ -76,7 +77,7 @@ def generate_lower_resolutions(data) -> list[dict]:
           print(f'image {i.name} is empty')
           continue
 
-        fp = paths.get_texture_filepath(tex_dir_path, i, resolution=p2res)
+        fp = paths.get_texture_filepath(tex_dir_path, i, resolution=p2res, filepath_counts=filepath_counts)
         if p2res == orig_res:
           # first, let's link the image back to the original one.
           i['blenderkit_original_path'] = i.filepath
@@ -86,6 +87,10 @@ def generate_lower_resolutions(data) -> list[dict]:
         else:
           # lower resolutions only downscale
           image_utils.make_possible_reductions_on_image(i, fp, do_reductions=False, do_downscale=True)
+        # reductions can change the extension (png->jpg), so count the path the image really ended up at.
+        if i.filepath != fp:
+          filepath_counts[fp] -= 1
+          filepath_counts[i.filepath] += 1
 
         abspath = bpy.path.abspath(i.filepath)
         if os.path.exists(abspath):
@@ -36,10 +36,11 @@ def unpack_asset(data):
     except Exception as e:
       print(e)
   bpy.data.use_autopack = False
+  filepath_counts = paths.get_image_filepath_counts()
   for image in bpy.data.images:
     if image.name != 'Render Result':
       # suffix = paths.resolution_suffix(data['suffix'])
-      fp = paths.get_texture_filepath(tex_dir_path, image, resolution=resolution)
+      fp = paths.get_texture_filepath(tex_dir_path, image, resolution=resolution, filepath_counts=filepath_counts)
       print('unpacking file', image.name)
       print(image.filepath, fp)
 
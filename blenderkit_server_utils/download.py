@@ -7,12 +7,15 @@ from . import paths
 SCENE_UUID = "5d22a2ce-7d4e-4500-9b1a-e5e79f8732c0"
 
 
-def server_2_local_filename(asset_data, filename):
-    """Convert file name on server to file name local. This should get replaced."""
+def server_2_local_filename(asset_data, filename, name_slug=None):
+    """Convert file name on server to file name local. This should get replaced.
+    Pass name_slug if the caller already slugified asset_data["name"]."""
 
     fn = filename.replace("blend_", "")
     fn = fn.replace("resolution_", "")
-    n = paths.slugify(asset_data["name"]) + "_" + fn
+    if name_slug is None:
+        name_slug = paths.slugify(asset_data["name"])
+    n = name_slug + "_" + fn
     return n
 
 
@@ -78,9 +81,9 @@ def get_download_filepath(
         directory = paths.get_download_dir(asset_data["assetType"])
 
     res_file, resolution = get_file_type(asset_data, resolution)
-    name_slug = paths.slugify(asset_data["name"])
-    if len(name_slug) > 16:
-        name_slug = name_slug[:16]
+    # slugify the name once, it's used for both the folder and the file name.
+    full_name_slug = paths.slugify(asset_data["name"])
+    name_slug = full_name_slug[:16]
     asset_folder_name = f"{name_slug}_{asset_data['id']}"
 
     file_names = []
@@ -92,12 +95,11 @@ def get_download_filepath(
         # remove resolution and blend words in names
         #
         fn = paths.extract_filename_from_url(res_file["url"])
-        n = server_2_local_filename(asset_data, fn)
+        n = server_2_local_filename(asset_data, fn, name_slug=full_name_slug)
 
         asset_folder_path = os.path.join(directory, asset_folder_name)
 
-        if not os.path.exists(asset_folder_path):
-            os.makedirs(asset_folder_path)
+        os.makedirs(asset_folder_path, exist_ok=True)
 
         file_name = os.path.join(asset_folder_path, n)
         file_names.append(file_name)
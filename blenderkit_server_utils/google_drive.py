@@ -1,25 +1,71 @@
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaFileUpload
+from googleapiclient.model import JsonModel
 from google.auth.transport.requests import Request
 from google.oauth2.service_account import Credentials
 import os
 import json
+import collections
+import threading
+import time
+
+# orjson parses Drive responses considerably faster, use it when it is installed.
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
 
 # Define the scope for the Google Drive API.
 # This scope allows for full read/write access to the authenticated user's account.
 SCOPES = ['https://www.googleapis.com/auth/drive']
 
 
+# Escape a value for use inside a single-quoted Drive query string.
+# Drive's query syntax requires backslashes and single quotes to be backslash-escaped.
+def _q_escape(value):
+    return value.replace('\\', '\\\\').replace("'", "\\'")
+
+
+# JSON model for googleapiclient that decodes responses with _json_loads.
+class _FastJsonModel(JsonModel):
+    def deserialize(self, content):
+        try:
+            body = _json_loads(content)
+        except ValueError:
+            # Not JSON, return the raw content like JsonModel does.
+            if isinstance(content, bytes):
+                content = content.decode('utf-8')
+            return content
+        if self._data_wrapper and 'data' in body:
+            body = body['data']
+        return body
+
+
+# Service account credentials shared by all Drive services in this process.
+# google.auth refreshes the token when it expires, so one object can serve every thread.
+_creds = None
+_creds_lock = threading.Lock()
+
+
+# Parse the service account key once and return the shared credentials.
+def _get_creds():
+    global _creds
+    with _creds_lock:
+        if _creds is None:
+            _creds = Credentials.from_service_account_info(
+                _json_loads(os.getenv('GDRIVE_SERVICE_ACCOUNT_KEY')), scopes=SCOPES)
+        return _creds
+
+
 # Initialize the Google Drive service.
 # This function handles authentication and returns a service object that can be used to interact with the API.
 def init_drive():
-    creds = None
     # Use service account credentials to authenticate.
-    creds = Credentials.from_service_account_info(
-        json.loads(os.getenv('GDRIVE_SERVICE_ACCOUNT_KEY')), scopes=SCOPES)
+    creds = _get_creds()
 
     # Build the service object.
-    service = build('drive', 'v3', credentials=creds)
+    service = build('drive', 'v3', credentials=creds, model=_FastJsonModel())
 
     return service
 
@@ -31,17 +77,13 @@ def list_files_in_folder(service, folder_id):
         pageSize=10, q=f"'{folder_id}' in parents  and trashed=false",
         includeItemsFromAllDrives=True,
         supportsAllDrives=True, fields="nextPageToken, files(id, name)").execute()
-    items = results.get('files', [])
-
-    # Print each file's name and ID.
-    for item in items:
-        print(f"Found file: {item['name']} ({item['id']})")
-    return items
+    # Return the items directly, callers print them if needed.
+    return results.get('files', [])
 
 # Check if a specific file exists in a Google Drive folder.
 def file_exists(service, filename, folder_id):
     # Query the API to search for the file in the folder.
-    query = f"name='{filename}' and '{folder_id}' in parents and trashed=false"
+    query = f"name='{_q_escape(filename)}' and '{folder_id}' in parents and trashed=false"
     results = service.files().list(q=query,
                                    includeItemsFromAllDrives=True,
                                    supportsAllDrives=True,
@@ -54,7 +96,7 @@ def file_exists(service, filename, folder_id):
 def file_exists_partial(service, partial_filename, folder_id):
     # Query the API to search for the file in the folder.
     # Use 'contains' keyword for partial match instead of an exact match.
-    query = f"name contains '{partial_filename}' and '{folder_id}' in parents and trashed=false"
+    query = f"name contains '{_q_escape(partial_filename)}' and '{folder_id}' in parents and trashed=false"
     results = service.files().list(q=query,
                                    includeItemsFromAllDrives=True,
                                    supportsAllDrives=True,
@@ -64,33 +106,67 @@ def file_exists_partial(service, partial_filename, folder_id):
     # If the file was found, return True. Otherwise, return False.
     return len(items) > 0
 
+# Folder ids found or created by ensure_folder_exists, keyed by (drive_id, parent_id, folder_name).
+# Values are (folder_id, time found), entries older than FOLDER_CACHE_TTL are looked up again,
+# so folders deleted outside of this process aren't handed out forever.
+# The per-key locks stop concurrent uploaders from creating duplicate same-name folders.
+FOLDER_CACHE_TTL = 300
+_folder_cache = {}
+_folder_locks = collections.defaultdict(threading.Lock)
+_folder_locks_lock = threading.Lock()
+
+
 # Ensure that a specific folder exists in Google Drive.
 # If the folder doesn't exist, it's created.
 def ensure_folder_exists(service, folder_name, parent_id='', drive_id='root'):
-    # Query the API to search for the folder.
-    query = f"name='{folder_name}' and '{parent_id}' in parents and mimeType='application/vnd.google-apps.folder' and trashed=false"
-    response = service.files().list(q=query,
-                                    corpora='drive',
-                                    driveId=drive_id,
-                                    includeItemsFromAllDrives=True,
-                                    supportsAllDrives=True,
-                                    fields='files(id, name)').execute()
-    items = response.get('files', [])
-
-    # If the folder exists, return its ID. Otherwise, create it and return its new ID.
-    if items:
-        return items[0]['id']
-    else:
-        metadata = {
-            'name': folder_name,
-            'mimeType': 'application/vnd.google-apps.folder',
-            'parents': [parent_id]
-        }
-        folder = service.files().create(body=metadata,
+    key = (drive_id, parent_id, folder_name)
+    with _folder_locks_lock:
+        folder_lock = _folder_locks[key]
+
+    with folder_lock:
+        # Another thread may have found or created the folder while we waited.
+        cached = _folder_cache.get(key)
+        if cached is not None and time.monotonic() - cached[1] < FOLDER_CACHE_TTL:
+            return cached[0]
+
+        # Query the API to search for the folder.
+        query = f"name='{_q_escape(folder_name)}' and '{parent_id}' in parents and mimeType='application/vnd.google-apps.folder' and trashed=false"
+        response = service.files().list(q=query,
+                                        corpora='drive',
+                                        driveId=drive_id,
+                                        includeItemsFromAllDrives=True,
                                         supportsAllDrives=True,
-                                        # driveId=drive_id,
-                                        fields='id').execute()
-        return folder['id']
+                                        fields='files(id, name)').execute()
+        items = response.get('files', [])
+
+        # If the folder exists, return its ID. Otherwise, create it and return its new ID.
+        if items:
+            folder_id = items[0]['id']
+        else:
+            metadata = {
+                'name': folder_name,
+                'mimeType': 'application/vnd.google-apps.folder',
+                'parents': [parent_id]
+            }
+            folder = service.files().create(body=metadata,
+                                            supportsAllDrives=True,
+                                            # driveId=drive_id,
+                                            fields='id').execute()
+            folder_id = folder['id']
+        _folder_cache[key] = (folder_id, time.monotonic())
+        return folder_id
+
+
+# Drop a deleted folder from the ensure_folder_exists cache, under the same per-key lock.
+def _forget_folder(folder_id):
+    with _folder_locks_lock:
+        keys = [key for key, cached in list(_folder_cache.items()) if cached[0] == folder_id]
+        folder_locks = [(key, _folder_locks[key]) for key in keys]
+    for key, folder_lock in folder_locks:
+        with folder_lock:
+            cached = _folder_cache.get(key)
+            if cached is not None and cached[0] == folder_id:
+                del _folder_cache[key]
 
 
 # Upload a file to a specific folder in Google Drive.
@@ -107,7 +183,7 @@ def upload_file_to_folder(service, file_path, folder_id):
                                   media_body=media,
                                   fields='id',
                                   supportsAllDrives=True).execute()
-    print(f"File ID: {file.get('id')}")
+    return file.get('id')
 
 import os
 
@@ -125,63 +201,124 @@ def upload_folder_to_drive(service, folder_path, drive_folder_id, drive_id):
                                                          drive_id=drive_id)
 
     # Iterate over all items in the local folder
+    uploaded_count = 0
+    uploaded_bytes = 0
     for item in os.listdir(folder_path):
         item_path = os.path.join(folder_path, item)
         # If the item is a file, upload it
         if os.path.isfile(item_path):
             upload_file_to_folder(service, item_path, drive_subfolder_id)
+            uploaded_count += 1
+            uploaded_bytes += os.path.getsize(item_path)
         # If the item is a folder, recursively call this function
         elif os.path.isdir(item_path):
             # This creates/ensures a subfolder on Drive and uploads the contents
-            upload_folder_to_drive(service, item_path, drive_subfolder_id)
+            upload_folder_to_drive(service, item_path, drive_subfolder_id, drive_id)
 
+    # One summary line per directory instead of one line per uploaded file.
+    print(f"Uploaded {uploaded_count} files ({uploaded_bytes} bytes) to {drive_subfolder_id}")
 
-def delete_empty_folders(service, folder_id, recursive=True):
-    """
-    Deletes all empty folders within the specified Google Drive folder.
 
-    :param service: Initialized Google Drive service object.
-    :param folder_id: The ID of the Google Drive folder to check for empty subfolders.
+# Drive accepts at most 100 calls in a single batch request.
+BATCH_SIZE = 100
+
+
+def _execute_batch(service, requests, callback):
+    """
+    Executes (request_id, request) pairs in batch requests of at most BATCH_SIZE calls.
+    The callback receives (request_id, response, exception) for every call.
     """
+    requests = list(requests)
+    for start in range(0, len(requests), BATCH_SIZE):
+        batch = service.new_batch_http_request(callback=callback)
+        for request_id, request in requests[start:start + BATCH_SIZE]:
+            batch.add(request, request_id=request_id)
+        batch.execute()
 
-    def get_subfolders(service, folder_id):
-        """ Helper function to retrieve subfolders with pagination """
-        subfolders = []
-        page_token = None
-        while True:
-            response = service.files().list(
-                q=f"mimeType='application/vnd.google-apps.folder' and '{folder_id}' in parents and trashed=false",
-                spaces='drive',
-                fields='nextPageToken, files(id, name)',
-                pageToken=page_token,
-                includeItemsFromAllDrives=True,
-                supportsAllDrives=True
-            ).execute()
+
+def _batch_list_subfolders(service, parent_ids):
+    """ Lists the subfolders of all given parents, one batch per page of results. """
+    subfolders = []
+    page_tokens = {parent_id: None for parent_id in parent_ids}
+    while page_tokens:
+        next_page_tokens = {}
+
+        def callback(request_id, response, exception):
+            if exception is not None:
+                raise exception
             subfolders.extend(response.get('files', []))
-            page_token = response.get('nextPageToken', None)
-            if page_token is None:
-                break
-        return subfolders
-
-    subfolders = get_subfolders(service, folder_id)
-
-    for folder in subfolders:
-        print(f"Checking folder: {folder['name']} ({folder['id']})")
-        # Check if the folder is empty
-        sub_query = f"'{folder['id']}' in parents and trashed=false"
-        sub_response = service.files().list(
-            q=sub_query,
-            fields='files(id)',
+            if response.get('nextPageToken'):
+                next_page_tokens[request_id] = response['nextPageToken']
+
+        requests = ((parent_id, service.files().list(
+            q=f"mimeType='application/vnd.google-apps.folder' and '{parent_id}' in parents and trashed=false",
+            spaces='drive',
+            fields='nextPageToken, files(id, name)',
+            pageToken=page_token,
             includeItemsFromAllDrives=True,
             supportsAllDrives=True
-        ).execute()
-        if not sub_response.get('files'):
-            # If the folder is empty, delete it
-            service.files().delete(fileId=folder['id'], supportsAllDrives=True).execute()
-            print(f"Deleted empty folder: {folder['name']} ({folder['id']})")
-        elif recursive:
-            # If the folder is not empty, recursively check its subfolders
-            delete_empty_folders(service, folder['id'])
+        )) for parent_id, page_token in page_tokens.items())
+        _execute_batch(service, requests, callback)
+        page_tokens = next_page_tokens
+    return subfolders
+
+
+def _batch_check_empty(service, folders):
+    """ Splits folders into (empty, non_empty) lists with one batch of single-item listings. """
+    non_empty_ids = set()
+
+    def callback(request_id, response, exception):
+        if exception is not None:
+            raise exception
+        if response.get('files'):
+            non_empty_ids.add(request_id)
+
+    requests = ((folder['id'], service.files().list(
+        q=f"'{folder['id']}' in parents and trashed=false",
+        pageSize=1,
+        fields='files(id)',
+        includeItemsFromAllDrives=True,
+        supportsAllDrives=True
+    )) for folder in folders)
+    _execute_batch(service, requests, callback)
 
+    empty = [folder for folder in folders if folder['id'] not in non_empty_ids]
+    non_empty = [folder for folder in folders if folder['id'] in non_empty_ids]
+    return empty, non_empty
 
 
+def _batch_delete(service, folders):
+    """ Deletes all given folders in batch requests. """
+    names = {folder['id']: folder['name'] for folder in folders}
+
+    def callback(request_id, response, exception):
+        if exception is not None:
+            raise exception
+        print(f"Deleted empty folder: {names[request_id]} ({request_id})")
+        # Don't hand out the deleted folder from the ensure_folder_exists cache.
+        _forget_folder(request_id)
+
+    requests = ((folder['id'], service.files().delete(fileId=folder['id'], supportsAllDrives=True))
+                for folder in folders)
+    _execute_batch(service, requests, callback)
+
+
+def delete_empty_folders(service, folder_id, recursive=True):
+    """
+    Deletes all empty folders within the specified Google Drive folder.
+    The tree is walked level by level, so every level costs a few batch requests
+    instead of several calls per folder.
+
+    :param service: Initialized Google Drive service object.
+    :param folder_id: The ID of the Google Drive folder to check for empty subfolders.
+    :param recursive: Also check subfolders of non-empty folders.
+    """
+    pending = collections.deque([folder_id])
+    while pending:
+        level = list(pending)
+        pending.clear()
+        subfolders = _batch_list_subfolders(service, level)
+        empty, non_empty = _batch_check_empty(service, subfolders)
+        _batch_delete(service, empty)
+        if recursive:
+            pending.extend(folder['id'] for folder in non_empty)
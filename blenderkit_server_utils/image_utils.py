@@ -1,11 +1,25 @@
 import os
 import time
 
+import numpy
+
 try:
   import bpy
 except:
   print('bpy not present')
 
+# Pillow is optional, when present plain JPEG/PNG saves skip Blender's render pipeline.
+try:
+  from PIL import Image as PILImage
+except ImportError:
+  PILImage = None
+
+# numba is optional, it compiles the normal map height reconstruction when available.
+try:
+  import numba
+except ImportError:
+  numba = None
+
 
 def get_orig_render_settings():
   rs = bpy.context.scene.render
@@ -38,26 +52,115 @@ def set_orig_render_settings(orig_settings):
   vs.view_transform = orig_settings['view_transform']
 
 
+def image_to_uint8(img, max_size=None):
+  '''
+  Returns the image pixels as a top-down (height, width, channels) uint8 array.
+  With max_size, larger images are box downscaled so their longer side is max_size, the image itself isn't changed.
+  '''
+  width, height = img.size[0], img.size[1]
+  channels = img.channels
+  buf = numpy.empty(width * height * channels, numpy.float32)
+  img.pixels.foreach_get(buf)
+  pixels = buf.reshape(height, width, channels)
+  if max_size is not None and max(width, height) > max_size:
+    scale = max_size / max(width, height)
+    pixels = box_downscale(pixels, max(1, round(width * scale)), max(1, round(height * scale)))
+  # Blender stores rows bottom-up.
+  return (pixels[::-1] * 255 + .5).clip(0, 255).astype(numpy.uint8)
+
+
+def colorspace_matches_view(img, view_transform):
+  '''
+  True if the image colorspace is what the view transform outputs, so save_render doesn't convert the pixels.
+  Standard outputs the sRGB display, Raw outputs the data as is.
+  '''
+  cs = img.colorspace_settings
+  if view_transform == 'Standard':
+    return (not cs.is_data and cs.name == 'sRGB'
+            and bpy.context.scene.display_settings.display_device == 'sRGB')
+  if view_transform == 'Raw':
+    return cs.is_data or cs.name in ('Non-Color', 'Raw')
+  return False
+
+
+def can_save_without_color_management(img, view_transform=None):
+  '''
+  True if save_render would write the 8 bit pixels of the image unchanged with the current scene view settings,
+  so they can be encoded directly.
+  view_transform - the view transform save_render will use, the scene's one by default.
+  '''
+  vs = bpy.context.scene.view_settings
+  if view_transform is None:
+    view_transform = vs.view_transform
+  return (PILImage is not None and not img.is_float and colorspace_matches_view(img, view_transform)
+          and vs.look == 'None' and vs.exposure == 0 and vs.gamma == 1 and not vs.use_curve_mapping)
+
+
+def save_uint8_as_webp(arr, filepath, quality, use_alpha=False):
+  '''Encodes an array from image_to_uint8 as WEBP with Pillow. Doesn't touch bpy, so it can run in worker threads.'''
+  channels = arr.shape[2]
+  if channels == 1:
+    pil_img = PILImage.fromarray(arr[:, :, 0], 'L')
+  elif use_alpha and channels == 4:
+    pil_img = PILImage.fromarray(arr, 'RGBA')
+  else:
+    pil_img = PILImage.fromarray(numpy.ascontiguousarray(arr[:, :, :3]), 'RGB')
+  pil_img.save(filepath, format='WEBP', quality=quality)
+
+
+def _save_with_pillow(img, filepath, file_format, quality, color_mode, compression):
+  '''Encodes the image pixels directly with Pillow, only valid when can_save_without_color_management is True.'''
+  arr = image_to_uint8(img)
+  channels = arr.shape[2]
+
+  if color_mode == 'RGBA' and channels == 4 and file_format == 'PNG':
+    pil_img = PILImage.fromarray(arr, 'RGBA')
+  else:
+    pil_img = PILImage.fromarray(numpy.ascontiguousarray(arr[:, :, :3]), 'RGB')
+
+  if file_format == 'JPEG':
+    pil_img.save(filepath, format='JPEG', quality=quality, subsampling=0)
+  else:
+    # Blender's PNG compression is a 0-100 percentage of zlib's 0-9 levels.
+    pil_img.save(filepath, format='PNG', compress_level=round(compression * 9 / 100))
+
+
 def img_save_as(img, filepath='//', file_format='JPEG', quality=90, color_mode='RGB', compression=15,
                 view_transform='Raw', exr_codec='DWAA'):
   '''Uses Blender 'save render' to save images - BLender isn't really able so save images with other methods correctly.'''
 
-  ors = get_orig_render_settings()
+  # fast path - 8 bit JPEG/PNG that the view wouldn't convert, so the pixels can be encoded directly.
+  # no caller in this repo gets here (the HDR thumbnail is Linear), it's for external callers of img_save_as.
+  # BW stays with save_render, which writes luminance with the colorspace's coefficients.
+  if (file_format in ('JPEG', 'PNG') and color_mode != 'BW'
+          and can_save_without_color_management(img, view_transform=view_transform)):
+    _save_with_pillow(img, bpy.path.abspath(filepath), file_format, quality, color_mode, compression)
+    return
 
   rs = bpy.context.scene.render
   vs = bpy.context.scene.view_settings
-
   ims = rs.image_settings
-  ims.file_format = file_format
-  ims.quality = quality
-  ims.color_mode = color_mode
-  ims.compression = compression
-  ims.exr_codec = exr_codec
-  vs.view_transform = view_transform
+
+  # only touch settings that differ, every assignment runs Blender's update callbacks.
+  changed = []
+  new_settings = (
+    (ims, 'file_format', file_format),
+    (ims, 'quality', quality),
+    (ims, 'color_mode', color_mode),
+    (ims, 'compression', compression),
+    (ims, 'exr_codec', exr_codec),
+    (vs, 'view_transform', view_transform),
+  )
+  for settings, name, value in new_settings:
+    orig_value = getattr(settings, name)
+    if orig_value != value:
+      changed.append((settings, name, orig_value))
+      setattr(settings, name, value)
 
   img.save_render(filepath=bpy.path.abspath(filepath), scene=bpy.context.scene)
 
-  set_orig_render_settings(ors)
+  for settings, name, orig_value in changed:
+    setattr(settings, name, orig_value)
 
 
 def set_colorspace(img, colorspace):
@@ -73,20 +176,60 @@ def set_colorspace(img, colorspace):
     print(f'Colorspace {colorspace} not found.')
 
 
+# pixel values above this mean the image really uses the HDR range
+TRUE_HDR_THRESHOLD = 1.05
+
+def _is_true_hdr(tempBuffer):
+  '''Checks if any value of a flat float32 pixel buffer is above TRUE_HDR_THRESHOLD.'''
+  # early exit on the first chunk that contains a bright pixel.
+  # the comparison result reuses one small mask, so the scan allocates nothing per chunk.
+  is_hdr = False
+  chunk = SCAN_CHUNK_PIXELS * 4
+  bright = numpy.empty(min(chunk, tempBuffer.size), numpy.bool_)
+  for start in range(0, tempBuffer.size, chunk):
+    part = tempBuffer[start:start + chunk]
+    part_bright = bright[:part.size]
+    numpy.greater(part, TRUE_HDR_THRESHOLD, out=part_bright)
+    if part_bright.any():
+      is_hdr = True
+      break
+  return is_hdr
+
+
 def analyze_image_is_true_hdr(image):
-  import numpy
-  scene = bpy.context.scene
-  ui_props = bpy.context.window_manager.blenderkitUI
-  size = image.size
-  imageWidth = size[0]
-  imageHeight = size[1]
+  '''
+  Reads the float pixels of an HDR image once and stores if it really uses the HDR range.
+  Returns - (flat float32 buffer, is_true_hdr), pass them to generate_hdr_thumbnail so it doesn't read the pixels again.
+  '''
+  imageWidth, imageHeight = image.size[0], image.size[1]
   tempBuffer = numpy.empty(imageWidth * imageHeight * 4, dtype=numpy.float32)
   image.pixels.foreach_get(tempBuffer)
-  image.blenderkit.true_hdr = numpy.amax(tempBuffer) > 1.05
 
+  is_hdr = _is_true_hdr(tempBuffer)
+  image.blenderkit.true_hdr = is_hdr
+  return tempBuffer, is_hdr
 
-def generate_hdr_thumbnail():
-  import numpy
+
+def box_downscale(pixels, width, height):
+  '''
+  Downscales a (h, w, channels) float array to (height, width, channels) by averaging the source pixels
+  that fall into every target pixel. Works for non-integer ratios too.
+  '''
+  src_height, src_width = pixels.shape[:2]
+  rows = numpy.arange(height) * src_height // height
+  cols = numpy.arange(width) * src_width // width
+  out = numpy.add.reduceat(pixels, rows, axis=0)
+  out = numpy.add.reduceat(out, cols, axis=1)
+  row_counts = numpy.diff(numpy.append(rows, src_height))
+  col_counts = numpy.diff(numpy.append(cols, src_width))
+  out /= (row_counts[:, None] * col_counts[None, :])[:, :, None]
+  return out
+
+
+def generate_hdr_thumbnail(pixels=None, is_hdr=None):
+  '''
+  pixels, is_hdr - optional result of analyze_image_is_true_hdr for the upload image, so it's read only once.
+  '''
   scene = bpy.context.scene
   ui_props = bpy.context.window_manager.blenderkitUI
   hdr_image = ui_props.hdr_upload_image  # bpy.data.images.get(ui_props.hdr_upload_image)
@@ -104,82 +247,90 @@ def generate_hdr_thumbnail():
   thumbnailWidth = min(size[0], max_thumbnail_size)
   thumbnailHeight = min(size[1], int(max_thumbnail_size / ratio))
 
-  tempBuffer = numpy.empty(imageWidth * imageHeight * 4, dtype=numpy.float32)
-  inew = bpy.data.images.new(thumb_name, imageWidth, imageHeight, alpha=False, float_buffer=False)
-
-  hdr_image.pixels.foreach_get(tempBuffer)
-
-  hdr_image.blenderkit.true_hdr = numpy.amax(tempBuffer) > 1.05
+  if pixels is None:
+    tempBuffer, is_hdr = analyze_image_is_true_hdr(hdr_image)
+  else:
+    tempBuffer = pixels
+    if is_hdr is None:
+      is_hdr = _is_true_hdr(tempBuffer)
+    hdr_image.blenderkit.true_hdr = is_hdr
+
+  # downscale before creating the thumbnail, so no full resolution byte image is ever allocated.
+  thumbBuffer = tempBuffer.reshape(imageHeight, imageWidth, 4)
+  if thumbnailWidth < imageWidth or thumbnailHeight < imageHeight:
+    thumbBuffer = box_downscale(thumbBuffer, thumbnailWidth, thumbnailHeight)
+  else:
+    thumbnailWidth, thumbnailHeight = imageWidth, imageHeight
 
+  inew = bpy.data.images.new(thumb_name, thumbnailWidth, thumbnailHeight, alpha=False, float_buffer=False)
   inew.filepath = thumb_path
   set_colorspace(inew, 'Linear')
-  inew.pixels.foreach_set(tempBuffer)
-
-  bpy.context.view_layer.update()
-  if thumbnailWidth < imageWidth:
-    inew.scale(thumbnailWidth, thumbnailHeight)
+  inew.pixels.foreach_set(thumbBuffer.ravel())
 
   img_save_as(inew, filepath=inew.filepath)
 
 
+# image.depth is bits per pixel over all channels, 32 can also be bw.. but image.channels doesn't work.
+DEPTH_TO_COLOR_MODE = {
+  8: 'BW',
+  24: 'RGB',
+  32: 'RGBA',
+  96: 'RGB',
+  128: 'RGBA',
+}
+DEPTH_TO_IMAGE_DEPTH = {
+  8: '8',
+  24: '8',
+  32: '8',
+  96: '16',
+  128: '16',
+}
+
+
 def find_color_mode(image):
-  if not isinstance(image, bpy.types.Image):
+  if __debug__ and not isinstance(image, bpy.types.Image):
     raise (TypeError)
-  else:
-    depth_mapping = {
-      8: 'BW',
-      24: 'RGB',
-      32: 'RGBA',  # can also be bw.. but image.channels doesn't work.
-      96: 'RGB',
-      128: 'RGBA',
-    }
-    return depth_mapping.get(image.depth, 'RGB')
+  return DEPTH_TO_COLOR_MODE.get(image.depth, 'RGB')
 
 
 def find_image_depth(image):
-  if not isinstance(image, bpy.types.Image):
+  if __debug__ and not isinstance(image, bpy.types.Image):
     raise (TypeError)
-  else:
-    depth_mapping = {
-      8: '8',
-      24: '8',
-      32: '8',  # can also be bw.. but image.channels doesn't work.
-      96: '16',
-      128: '16',
-    }
-    return depth_mapping.get(image.depth, '8')
+  return DEPTH_TO_IMAGE_DEPTH.get(image.depth, '8')
+
+
+# number of pixels checked at once by the early-exit scans below
+SCAN_CHUNK_PIXELS = 1 << 16
 
 
 def can_erase_alpha(na):
-  alpha = na[3::4]
-  alpha_sum = alpha.sum()
-  if alpha_sum == alpha.size:
+  px = na.reshape(-1, 4)
+  # scan in chunks, most images fail on the first chunk already.
+  alpha_opaque = True
+  for start in range(0, px.shape[0], SCAN_CHUNK_PIXELS):
+    if not (px[start:start + SCAN_CHUNK_PIXELS, 3] == 1.0).all():
+      alpha_opaque = False
+      break
+  if alpha_opaque:
     print('image can have alpha erased')
-  # print(alpha_sum, alpha.size)
-  return alpha_sum == alpha.size
+  return alpha_opaque
 
 
 def is_image_black(na):
-  r = na[::4]
-  g = na[1::4]
-  b = na[2::4]
-
-  rgbsum = r.sum() + g.sum() + b.sum()
-
-  # print('rgb sum', rgbsum, r.sum(), g.sum(), b.sum())
-  if rgbsum == 0:
+  px = na.reshape(-1, 4)
+  is_black = True
+  for start in range(0, px.shape[0], SCAN_CHUNK_PIXELS):
+    if px[start:start + SCAN_CHUNK_PIXELS, :3].any():
+      is_black = False
+      break
+  if is_black:
     print('image can have alpha channel dropped')
-  return rgbsum == 0
+  return is_black
 
 
 def is_image_bw(na):
-  r = na[::4]
-  g = na[1::4]
-  b = na[2::4]
-
-  rg_equal = r == g
-  gb_equal = g == b
-  rgbequal = rg_equal.all() and gb_equal.all()
+  px = na.reshape(-1, 4)
+  rgbequal = bool((px[:, 0] == px[:, 1]).all() and (px[:, 1] == px[:, 2]).all())
   if rgbequal:
     print('image is black and white, can have channels reduced')
 
@@ -188,30 +339,12 @@ def is_image_bw(na):
 
 def numpytoimage(a, iname, width=0, height=0, channels=3):
   t = time.time()
-  foundimage = False
-
-  for image in bpy.data.images:
-
-    if image.name[:len(iname)] == iname and image.size[0] == a.shape[0] and image.size[1] == a.shape[1]:
-      i = image
-      foundimage = True
-  if not foundimage:
-    if channels == 4:
-      bpy.ops.image.new(name=iname, width=width, height=height, color=(0, 0, 0, 1), alpha=True,
-                        generated_type='BLANK', float=True)
-    if channels == 3:
-      bpy.ops.image.new(name=iname, width=width, height=height, color=(0, 0, 0), alpha=False,
-                        generated_type='BLANK', float=True)
-
-  i = None
-
-  for image in bpy.data.images:
-    # print(image.name[:len(iname)],iname, image.size[0],a.shape[0],image.size[1],a.shape[1])
-    if image.name[:len(iname)] == iname and image.size[0] == width and image.size[1] == height:
-      i = image
+  # one name lookup instead of scanning all images, existing images are reused and resized if needed.
+  i = bpy.data.images.get(iname)
+  if i is not None and (i.size[0] != width or i.size[1] != height):
+    i.scale(width, height)
   if i is None:
-    i = bpy.data.images.new(iname, width, height, alpha=False, float_buffer=False, stereo3d=False, is_data=False,
-                            tiled=False)
+    i = bpy.data.images.new(iname, width, height, alpha=channels == 4, float_buffer=True)
 
   # dropping this re-shaping code -  just doing flat array for speed and simplicity
   #    d = a.shape[0] * a.shape[1]
@@ -219,22 +352,56 @@ def numpytoimage(a, iname, width=0, height=0, channels=3):
   #    a = a.reshape(d)
   #    a = a.repeat(channels)
   #    a[3::4] = 1
+  if channels == 1:
+    # single channel data, expanded to the 4 channels Blender stores only here at upload.
+    gray = a.reshape(-1)
+    a = numpy.empty(gray.size * 4, numpy.float32)
+    a[0::4] = gray
+    a[1::4] = gray
+    a[2::4] = gray
+    a[3::4] = 1
+  # foreach_set copies the buffer directly only for contiguous float32 data, anything else is converted per item.
+  if a.dtype != numpy.float32 or not a.flags['C_CONTIGUOUS']:
+    a = numpy.ascontiguousarray(a, dtype=numpy.float32)
   i.pixels.foreach_set(a)  # this gives big speedup!
   print('\ntime ' + str(time.time() - t))
   return i
 
 
-def imagetonumpy_flat(i):
-  t = time.time()
+# scratch buffer reused by pixel reads whose result doesn't leave the calling function.
+_scratch_buffer = numpy.empty(0, numpy.float32)
+# largest scratch buffer kept between calls (2k RGBA, 64 MB), bigger reads get their own array,
+# so one huge texture doesn't keep gigabytes allocated for the rest of a batch.
+SCRATCH_BUFFER_MAX_SIZE = 2048 * 2048 * 4
+
 
-  import numpy
+def get_scratch_buffer(size):
+  '''
+  Returns a float32 buffer of the given size that is reused between calls, so batches of similar
+  textures don't allocate fresh multi-MB arrays every time. Only one buffer is kept, grown when needed
+  up to SCRATCH_BUFFER_MAX_SIZE.
+  The content is overwritten by the next call, don't keep references to it.
+  '''
+  global _scratch_buffer
+  if size > SCRATCH_BUFFER_MAX_SIZE:
+    return numpy.empty(size, numpy.float32)
+  if _scratch_buffer.size < size:
+    _scratch_buffer = numpy.empty(size, numpy.float32)
+  return _scratch_buffer[:size]
+
+
+def imagetonumpy_flat(i, use_scratch_buffer=False):
+  t = time.time()
 
   width = i.size[0]
   height = i.size[1]
   # print(i.channels)
 
   size = width * height * i.channels
-  na = numpy.empty(size, numpy.float32)
+  if use_scratch_buffer:
+    na = get_scratch_buffer(size)
+  else:
+    na = numpy.empty(size, numpy.float32)
   i.pixels.foreach_get(na)
 
   # dropping this re-shaping code -  just doing flat array for speed and simplicity
@@ -249,14 +416,12 @@ def imagetonumpy_flat(i):
 def imagetonumpy(i):
   t = time.time()
 
-  import numpy as np
-
   width = i.size[0]
   height = i.size[1]
   # print(i.channels)
 
   size = width * height * i.channels
-  na = np.empty(size, np.float32)
+  na = numpy.empty(size, numpy.float32)
   i.pixels.foreach_get(na)
 
   # dropping this re-shaping code -  just doing flat array for speed and simplicity
@@ -278,32 +443,24 @@ def downscale(i):
     i.scale(sx, sy)
 
 
-def get_rgb_mean(i):
-  '''checks if normal map values are ok.'''
-  import numpy
-
-  na = imagetonumpy_flat(i)
-
-  r = na[::4]
-  g = na[1::4]
-  b = na[2::4]
-
-  rmean = r.mean()
-  gmean = g.mean()
-  bmean = b.mean()
+def get_rgb_mean(i, na=None):
+  '''
+  checks if normal map values are ok.
+  na - optional flat pixel array of the image that was already read, to avoid reading the pixels again.
+  '''
+  if na is None:
+    na = imagetonumpy_flat(i, use_scratch_buffer=True)
 
-  rmedian = numpy.median(r)
-  gmedian = numpy.median(g)
-  bmedian = numpy.median(b)
+  # one pass over the pixels for all three channels, accumulated in float64 to stay precise on big images.
+  rmean, gmean, bmean = na.reshape(-1, 4)[:, :3].mean(axis=0, dtype=numpy.float64)
 
-  #    return(rmedian,gmedian, bmedian)
-  return (rmean, gmean, bmean)
+  return (numpy.float32(rmean), numpy.float32(gmean), numpy.float32(bmean))
 
 
-def check_nmap_mean_ok(i):
+def check_nmap_mean_ok(i, na=None):
   '''checks if normal map values are in standard range.'''
 
-  rmean, gmean, bmean = get_rgb_mean(i)
+  rmean, gmean, bmean = get_rgb_mean(i, na=na)
 
   # we could/should also check blue, but some ogl substance exports have 0-1, while 90% nmaps have 0.5 - 1.
   nmap_ok = 0.45 < rmean < 0.55 and .45 < gmean < .55
@@ -311,67 +468,111 @@ def check_nmap_mean_ok(i):
   return nmap_ok
 
 
-def check_nmap_ogl_vs_dx(i, mask=None, generated_test_images=False):
+if numba is not None:
+  @numba.njit(cache=True)
+  def _nmap_heights_kernel(na, rmean, gmean, mask_alpha, ogl, dx):
+    '''Compiled per-pixel height reconstruction, writes into the preallocated ogl and dx arrays.'''
+    width, height = ogl.shape
+    use_mask = mask_alpha.shape[0] > 0
+    zero = numpy.float32(0)
+    half = numpy.float32(0.5)
+    for y in range(height):
+      for x in range(width):
+        if use_mask and not mask_alpha[x, y]:
+          continue
+        diff_x = (na[x, y, 0] - rmean) / (na[x, y, 2] - half)
+        diff_y = (na[x, y, 1] - gmean) / (na[x, y, 2] - half)
+
+        last_height_x = ogl[x - 1, y] if x > 0 else zero
+        last_height_y = ogl[x, y - 1] if y > 0 else zero
+        ogl[x, y] = ((last_height_x + last_height_y) - diff_x - diff_y) * half
+
+        last_height_x = dx[x - 1, y] if x > 0 else zero
+        last_height_y = dx[x, y - 1] if y > 0 else zero
+        dx[x, y] = ((last_height_x + last_height_y) - diff_x + diff_y) * half
+
+
+def reconstruct_nmap_heights(na, rmean, gmean, mask_alpha=None):
+  '''
+  Integrates a normal map (W, H, channels array) into height fields, once with OpenGL and once with DirectX
+  green channel orientation. Every height is the average of its left and lower neighbour minus the local slope,
+  so all pixels on one anti-diagonal (x + y == d) only depend on the previous diagonal and are computed together.
+  Pixels outside of mask_alpha stay at zero.
+  Uses the compiled kernel when numba is installed, the numpy wavefront otherwise.
+  Returns - (ogl, dx) arrays of shape (W, H)
+  '''
+  width, height = na.shape[0], na.shape[1]
+
+  if numba is not None:
+    ogl = numpy.zeros((width, height), numpy.float32)
+    dx = numpy.zeros((width, height), numpy.float32)
+    if mask_alpha is None:
+      mask_alpha = numpy.zeros((0, 0), numpy.bool_)
+    _nmap_heights_kernel(na, numpy.float32(rmean), numpy.float32(gmean), mask_alpha, ogl, dx)
+    return ogl, dx
+
+  # slopes per pixel
+  diff_x = (na[:, :, 0] - rmean) / (na[:, :, 2] - 0.5)
+  diff_y = (na[:, :, 1] - gmean) / (na[:, :, 2] - 0.5)
+
+  # heights are padded with a zero row and column, so neighbours of the first row/column read zero.
+  ogl = numpy.zeros((width + 1, height + 1), numpy.float32)
+  dx = numpy.zeros((width + 1, height + 1), numpy.float32)
+
+  for d in range(width + height - 1):
+    xs = numpy.arange(max(0, d - height + 1), min(d, width - 1) + 1)
+    ys = d - xs
+    dxs = diff_x[xs, ys]
+    dys = diff_y[xs, ys]
+    ogl_d = ((ogl[xs, ys + 1] + ogl[xs + 1, ys]) - dxs - dys) / 2
+    dx_d = ((dx[xs, ys + 1] + dx[xs + 1, ys]) - dxs + dys) / 2
+    if mask_alpha is not None:
+      m = mask_alpha[xs, ys]
+      ogl_d = numpy.where(m, ogl_d, 0)
+      dx_d = numpy.where(m, dx_d, 0)
+    ogl[xs + 1, ys + 1] = ogl_d
+    dx[xs + 1, ys + 1] = dx_d
+
+  return ogl[1:, 1:], dx[1:, 1:]
+
+
+def check_nmap_ogl_vs_dx(i, mask=None, generated_test_images=False, na=None, means=None):
   '''
   checks if normal map is directX or OpenGL.
+  na, means - optional flat pixel array and get_rgb_mean result of the image, if the caller already has them.
+  The pixels are read from Blender only once either way.
   Returns - String value - DirectX and OpenGL
   '''
-  import numpy
   width = i.size[0]
   height = i.size[1]
 
-  rmean, gmean, bmean = get_rgb_mean(i)
+  if na is None:
+    na = imagetonumpy_flat(i)
+  if means is None:
+    means = get_rgb_mean(i, na=na)
+  rmean, gmean, bmean = means
 
-  na = imagetonumpy(i)
+  # same (width, height, channels) view as imagetonumpy returns
+  na = na.reshape(height, width, i.channels).swapaxes(0, 1)
 
   if mask:
     mask = imagetonumpy(mask)
+  else:
+    mask = None
 
-  red_x_comparison = numpy.zeros((width, height), numpy.float32)
-  green_y_comparison = numpy.zeros((width, height), numpy.float32)
-
-  if generated_test_images:
-    red_x_comparison_img = numpy.empty((width, height, 4), numpy.float32)  # images for debugging purposes
-    green_y_comparison_img = numpy.empty((width, height, 4), numpy.float32)  # images for debugging purposes
+  mask_alpha = None
+  if mask is not None:
+    mask_alpha = mask[:, :, 3] > 0
 
-  ogl = numpy.zeros((width, height), numpy.float32)
-  dx = numpy.zeros((width, height), numpy.float32)
+  ogl, dx = reconstruct_nmap_heights(na, rmean, gmean, mask_alpha)
 
   if generated_test_images:
-    ogl_img = numpy.empty((width, height, 4), numpy.float32)  # images for debugging purposes
-    dx_img = numpy.empty((width, height, 4), numpy.float32)  # images for debugging purposes
-
-  for y in range(0, height):
-    for x in range(0, width):
-      # try to mask with UV mask image
-      if mask is None or mask[x, y, 3] > 0:
-
-        last_height_x = ogl[max(x - 1, 0), min(y, height - 1)]
-        last_height_y = ogl[max(x, 0), min(y - 1, height - 1)]
-
-        diff_x = ((na[x, y, 0] - rmean) / ((na[x, y, 2] - 0.5)))
-        diff_y = ((na[x, y, 1] - gmean) / ((na[x, y, 2] - 0.5)))
-        calc_height = (last_height_x + last_height_y) \
-                      - diff_x - diff_y
-        calc_height = calc_height / 2
-        ogl[x, y] = calc_height
-        if generated_test_images:
-          rgb = calc_height * .1 + .5
-          ogl_img[x, y] = [rgb, rgb, rgb, 1]
-
-        # green channel
-        last_height_x = dx[max(x - 1, 0), min(y, height - 1)]
-        last_height_y = dx[max(x, 0), min(y - 1, height - 1)]
-
-        diff_x = ((na[x, y, 0] - rmean) / ((na[x, y, 2] - 0.5)))
-        diff_y = ((na[x, y, 1] - gmean) / ((na[x, y, 2] - 0.5)))
-        calc_height = (last_height_x + last_height_y) \
-                      - diff_x + diff_y
-        calc_height = calc_height / 2
-        dx[x, y] = calc_height
-        if generated_test_images:
-          rgb = calc_height * .1 + .5
-          dx_img[x, y] = [rgb, rgb, rgb, 1]
+    # single channel images for debugging purposes, in Blender's (height, width) pixel order.
+    ogl_rgb = ogl.T * .1 + .5
+    dx_rgb = dx.T * .1 + .5
+    if mask_alpha is not None:
+      ogl_rgb = numpy.where(mask_alpha.T, ogl_rgb, 0)
+      dx_rgb = numpy.where(mask_alpha.T, dx_rgb, 0)
 
   ogl_std = ogl.std()
   dx_std = dx.std()
@@ -396,14 +597,8 @@ def check_nmap_ogl_vs_dx(i, mask=None, generated_test_images=False):
     # numpytoimage(red_x_comparison_img, 'red_' + i.name, width=width, height=height, channels=1)
     # numpytoimage(green_y_comparison_img, 'green_' + i.name, width=width, height=height, channels=1)
 
-    ogl_img = ogl_img.swapaxes(0, 1)
-    ogl_img = ogl_img.flatten()
-
-    dx_img = dx_img.swapaxes(0, 1)
-    dx_img = dx_img.flatten()
-
-    numpytoimage(ogl_img, 'OpenGL', width=width, height=height, channels=1)
-    numpytoimage(dx_img, 'DirectX', width=width, height=height, channels=1)
+    numpytoimage(ogl_rgb, 'OpenGL', width=width, height=height, channels=1)
+    numpytoimage(dx_rgb, 'DirectX', width=width, height=height, channels=1)
 
   if abs(ogl_std) > abs(dx_std):
     return 'DirectX'
@@ -16,7 +16,11 @@
 #
 # ##### END GPL LICENSE BLOCK #####
 
+import bisect
+import collections
+import functools
 import os
+import re
 import shutil
 import sys
 try:
@@ -46,6 +50,7 @@ rkeys = list(resolutions.keys())
 def get_api_url():
   return SERVER + BLENDERKIT_API
 
+@functools.lru_cache(maxsize=1)
 def default_global_dict():
   home = os.path.expanduser("~")
   data_home = os.environ.get('XDG_DATA_HOME')
@@ -54,40 +59,37 @@ def default_global_dict():
   return home + os.sep + 'blenderkit_data'
 
 
+@functools.lru_cache(maxsize=8)
 def get_download_dir(asset_type):
-  ''' get directories where assets will be downloaded'''
+  ''' get directories where assets will be downloaded, the directories are created only on the first call per type.'''
   subdmapping = {'brush': 'brushes', 'texture': 'textures', 'model': 'models', 'scene': 'scenes',
                  'material': 'materials', 'hdr': 'hdrs'}
 
   ddir = default_global_dict()
-  if not os.path.exists(ddir):
-    os.makedirs(ddir)
-
   subd = subdmapping[asset_type]
   subdir = os.path.join(ddir, subd)
-  if not os.path.exists(subdir):
-    os.makedirs(subdir)
+  # creates the global dir too, and doesn't race with other processes creating it.
+  os.makedirs(subdir, exist_ok=True)
   return subdir
 
 
+# characters replaced by underscores in slugify
+SLUG_TRANSLATION = str.maketrans({ch: '_' for ch in '<>:"/\\|?*., ()#'})
+SLUG_STRIP_RE = re.compile(r'[^a-z0-9]+.- ')
+SLUG_DASHES_RE = re.compile(r'[-]+')
+
+
 def slugify(slug):
   """
   Normalizes string, converts to lowercase, removes non-alpha characters,
   and converts spaces to hyphens.
   """
-  import re
-  slug = slug.lower()
-
-  characters = '<>:"/\\|?\*., ()#'
-  for ch in characters:
-    slug = slug.replace(ch, '_')
+  slug = slug.lower().translate(SLUG_TRANSLATION)
   # import re
   # slug = unicodedata.normalize('NFKD', slug)
   # slug = slug.encode('ascii', 'ignore').lower()
-  slug = re.sub(r'[^a-z0-9]+.- ', '-', slug).strip('-')
-  slug = re.sub(r'[-]+', '-', slug)
-  slug = re.sub(r'/', '_', slug)
-  slug = re.sub(r'\\\'\"', '_', slug)
+  slug = SLUG_STRIP_RE.sub('-', slug).strip('-')
+  slug = SLUG_DASHES_RE.sub('-', slug)
   if len(slug) > 50:
     slug = slug[:50]
   return slug
@@ -97,9 +99,7 @@ def extract_filename_from_url(url: str) -> str:
   """Extract filename from URL."""
 
   if url is not None:
-    imgname = url.split('/')[-1]
-    imgname = imgname.split('?')[0]
-    return imgname
+    return url.rpartition('/')[2].partition('?')[0]
   return ''
 
 
@@ -111,26 +111,18 @@ resolution_suffix = {
   'resolution_4K': '_4k',
   'resolution_8K': '_8k',
 }
-resolutions = {
-  'resolution_0_5K': 512,
-  'resolution_1K': 1024,
-  'resolution_2K': 2048,
-  'resolution_4K': 4096,
-  'resolution_8K': 8192,
-}
 
 
-def round_to_closest_resolution(res):
-  rdist = 1000000
-  #    while res/2>1:
-  #        p2res*=2
-  #        res = res/2
-  for rkey in resolutions:
-    d = abs(res - resolutions[rkey])
-    if d < rdist:
-      rdist = d
-      p2res = rkey
+# resolution keys and sizes sorted by size, for bisecting in round_to_closest_resolution
+sorted_resolutions = sorted(resolutions.items(), key=lambda item: item[1])
+sorted_resolution_sizes = [size for rkey, size in sorted_resolutions]
 
+
+def round_to_closest_resolution(res):
+  # only the two neighbours of the insertion point can be the closest, ties go to the smaller resolution.
+  i = bisect.bisect_left(sorted_resolution_sizes, res)
+  candidates = sorted_resolutions[max(0, i - 1):i + 1]
+  p2res = min(candidates, key=lambda item: abs(res - item[1]))[0]
   return p2res
 
 
@@ -148,31 +140,32 @@ def get_res_file(asset_data, resolution, find_closest_with_url=False):
       resolution file
       resolution, so that other processess can pass correctly which resolution is downloaded.
   '''
-  orig = None
-  res = None
+  # index the files by type once, the first file of each type wins.
+  # with find_closest_with_url, resolution files without url are left out right away.
+  files_by_type = {}
+  for f in asset_data['files']:
+    if find_closest_with_url and f['fileType'] != 'blend' and not f.get('url'):
+      continue
+    files_by_type.setdefault(f['fileType'], f)
+
+  # exact match found (this also covers the orig 'blend' file), return.
+  if resolution in files_by_type:
+    return files_by_type[resolution], resolution
+
+  # find closest resolution if the exact match won't be found.
   closest = None
   target_resolution = resolutions.get(resolution)
-  mindist = 100000000
-
-  for f in asset_data['files']:
-    if f['fileType'] == 'blend':
-      orig = f
-      if resolution == 'blend':
-        # orig file found, return.
-        return orig, 'blend'
-
-    if f['fileType'] == resolution:
-      # exact match found, return.
-      return f, resolution
-    # find closest resolution if the exact match won't be found.
-    rval = resolutions.get(f['fileType'])
-    if rval and target_resolution:
-      rdiff = abs(target_resolution - rval)
-      if rdiff < mindist:
-        closest = f
-        mindist = rdiff
-  if not res and not closest:
-    return orig, 'blend'
+  if target_resolution:
+    mindist = 100000000
+    for file_type, f in files_by_type.items():
+      rval = resolutions.get(file_type)
+      if rval:
+        rdiff = abs(target_resolution - rval)
+        if rdiff < mindist:
+          closest = f
+          mindist = rdiff
+  if not closest:
+    return files_by_type.get('blend'), 'blend'
   return closest, closest['fileType']
 
 
@@ -188,12 +181,26 @@ def server_2_local_filename(asset_data, filename):
   return n
 
 
+# relative texture directory for every resolution, see get_texture_directory
+texture_directories = {rkey: f"//textures{suffix}{os.sep}" for rkey, suffix in resolution_suffix.items()}
+
+
 def get_texture_directory(asset_data, resolution='blend'):
-  tex_dir_path = f"//textures{resolution_suffix[resolution]}{os.sep}"
-  return tex_dir_path
+  return texture_directories[resolution]
+
 
+def get_image_filepath_counts():
+  # how many images use each filepath, build once and pass to get_texture_filepath in loops over images.
+  return collections.Counter(image.filepath for image in bpy.data.images)
 
-def get_texture_filepath(tex_dir_path, image, resolution='blend'):
+
+def get_texture_filepath(tex_dir_path, image, resolution='blend', filepath_counts=None):
+  '''
+  Returns a texture filepath in tex_dir_path that isn't used by any other image.
+  filepath_counts - optional result of get_image_filepath_counts(), shared between calls for all images.
+      It gets updated as if the image was moved to the returned filepath,
+      callers that end up saving the image elsewhere (e.g. png->jpg) must move the count themselves.
+  '''
   if len(image.packed_files) > 0:
     image_file_name = bpy.path.basename(image.packed_files[0].filepath)
   else:
@@ -204,20 +211,22 @@ def get_texture_filepath(tex_dir_path, image, resolution='blend'):
   fp = os.path.join(tex_dir_path, image_file_name)
   # check if there is allready an image with same name and thus also assigned path
   # (can happen easily with genearted tex sets and more materials)
-  done = False
+  # count the taken paths once, then just count up until the name is free.
+  if filepath_counts is None:
+    filepath_counts = get_image_filepath_counts()
+
+  def is_taken(filepath):
+    return filepath_counts[filepath] - (filepath == image.filepath) > 0
+
   fpn = fp
+  fpleft, fpext = os.path.splitext(fp)
   i = 0
-  while not done:
-    is_solo = True
-    for image1 in bpy.data.images:
-      if image != image1 and image1.filepath == fpn:
-        is_solo = False
-        fpleft, fpext = os.path.splitext(fp)
-        fpn = fpleft + str(i).zfill(3) + fpext
-        i += 1
-    if is_solo:
-      done = True
+  while is_taken(fpn):
+    fpn = fpleft + str(i).zfill(3) + fpext
+    i += 1
 
+  filepath_counts[image.filepath] -= 1
+  filepath_counts[fpn] += 1
   return fpn
 
 def delete_asset_debug(asset_data):
@@ -239,14 +248,14 @@ def delete_asset_debug(asset_data):
         print(f'{e}')
 
 
+# dir_path is resolved once at import, realpath hits the filesystem.
+clean_filepath = os.path.join(dir_path, "blendfiles" + os.sep + "cleaned.blend")
+
+
 def get_clean_filepath():
-  script_path = os.path.dirname(os.path.realpath(__file__))
-  subpath = "blendfiles" + os.sep + "cleaned.blend"
-  cp = os.path.join(script_path, subpath)
-  return cp
+  return clean_filepath
 
 
 def get_addon_file(subpath=''):
-  script_path = os.path.dirname(os.path.realpath(__file__))
   # fpath = os.path.join(p, subpath)
-  return os.path.join(script_path, subpath)
+  return os.path.join(dir_path, subpath)
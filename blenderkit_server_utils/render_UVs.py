@@ -1,4 +1,5 @@
 import bpy
+import numpy
 
 
 # Sets up the camera within the given scene for rendering the UV layout.
@@ -23,6 +24,13 @@ def set_render_settings(scene, filepath):
     # Use the Cycles render engine for high-quality rendering.
     scene.render.engine = "CYCLES"
     scene.cycles.samples = 5  # Reduce samples for faster rendering of simple scenes.
+    # Flat emission needs no denoising or adaptive sampling, skip their setup cost.
+    scene.cycles.use_adaptive_sampling = False
+    scene.cycles.use_denoising = False
+    if bpy.app.version >= (3, 0, 0):
+        scene.cycles.tile_size = 1024  # Render the whole image as one tile.
+    if bpy.app.version >= (3, 5, 0):
+        scene.cycles.use_light_tree = False
 
     # Set output format to WEBP, resolution, and file path for saving the render.
     scene.render.image_settings.file_format = "WEBP"
@@ -42,10 +50,9 @@ def render_and_save(scene):
 
 # Cleans up by removing the temporary scene and its objects after rendering.
 def cleanup_scene(scene):
-    bpy.ops.object.select_all(action="DESELECT")
-    for obj in scene.objects:
-        obj.select_set(True)
-    bpy.ops.object.delete()  # Delete all objects in the scene.
+    # Delete all objects in the scene.
+    for obj in list(scene.objects):
+        bpy.data.objects.remove(obj, do_unlink=True)
     bpy.data.scenes.remove(scene)  # Remove the temporary scene.
 
 
@@ -72,8 +79,19 @@ def export_uvs_as_webps(obs, filepath):
     bpy.context.window.scene = original_scene  # Revert to the original scene.
 
 
+# The UV layout material from the last get_UV_material call, reused while it exists.
+_uv_material = None
+
+
 # Retrieves or creates a material designed for rendering UV layouts.
 def get_UV_material():
+    global _uv_material
+    if _uv_material is not None:
+        try:
+            if _uv_material.name == "UV_RENDER_MATERIAL":
+                return _uv_material
+        except ReferenceError:
+            pass  # The material was removed or a new file was loaded.
     m = bpy.data.materials.get("UV_RENDER_MATERIAL")
     if m is None:
         m = bpy.data.materials.new("UV_RENDER_MATERIAL")
@@ -108,12 +126,26 @@ def get_UV_material():
             mix_shader_node.outputs["Shader"], material_output_node.inputs["Surface"]
         )
 
+    _uv_material = m
     return m
 
 
+# Builds mesh faces from polygon loop starts and sizes, each face lists its loop indices.
+def loop_faces(starts, totals):
+    if len(starts) > 0 and totals.min() == totals.max():
+        # All polygons have the same size (all tris or all quads), build indices at once.
+        return (starts[:, None] + numpy.arange(totals[0])[None, :]).tolist()
+    return [list(range(s, s + t)) for s, t in zip(starts.tolist(), totals.tolist())]
+
+
 def build_uv_meshes(obs, scene):
     m = get_UV_material()  # Retrieve or create the UV layout rendering material.
     i = 0  # Counter to slightly offset each UV mesh object for visibility.
+    # Vertices and polygon loops of the smaller UV meshes, merged into one wireframe object at the end.
+    wire_verts = []
+    wire_starts = []
+    wire_totals = []
+    wire_vert_count = 0
 
     for ob in obs:
         me = ob.data  # The mesh data of the object.
@@ -128,21 +160,23 @@ def build_uv_meshes(obs, scene):
 
         uv_layer = me.uv_layers.active  # The active UV layer of the mesh.
 
-        # Retrieve UV coordinates.
-        uvs = [0] * (2 * len(me.loops))
+        # Retrieve UV coordinates into a float32 buffer, foreach_get fills it in one copy.
+        uvs = numpy.empty(2 * len(me.loops), dtype=numpy.float32)
         uv_layer.data.foreach_get("uv", uvs)
-        x = uvs[0::2]
-        y = uvs[1::2]
-        z = [0] * len(x)  # Create a Z-axis array filled with zeros for 2D UV layout.
 
         # Create a new mesh for the UV layout.
         uvme = bpy.data.meshes.new("UVMesh_" + ob.name)
-        verts = [
-            (x[i], y[i], z[i]) for i in range(len(x))
-        ]  # Combine x, y, z coordinates into vertices.
-        faces = [
-            p.loop_indices for p in me.polygons
-        ]  # Create faces from the polygons of the original mesh.
+        # Combine x, y coordinates into vertices, Z stays zero for 2D UV layout.
+        verts = numpy.empty((len(me.loops), 3), dtype=numpy.float32)
+        verts[:, 0:2] = uvs.reshape(-1, 2)
+        verts[:, 2] = 0.0
+        # Create faces from the polygons of the original mesh.
+        n_polys = len(me.polygons)
+        starts = numpy.empty(n_polys, dtype=numpy.int32)
+        totals = numpy.empty(n_polys, dtype=numpy.int32)
+        me.polygons.foreach_get("loop_start", starts)
+        me.polygons.foreach_get("loop_total", totals)
+        faces = loop_faces(starts, totals)
 
         # Convert UV data to mesh data.
         uvme.from_pydata(verts, [], faces)
@@ -154,19 +188,35 @@ def build_uv_meshes(obs, scene):
         # Assign the previously created UV material to the new object.
         uv_object.data.materials.append(m)
 
-        # Select and activate the UV object for further operations.
-        bpy.context.view_layer.objects.active = uv_object
-        uv_object.select_set(True)
-
         # Offset each UV object slightly on the Z-axis to prevent z-fighting in the render.
         uv_object.location.z -= i * 0.01
         i += 1
 
         if len(uv_object.data.vertices) < 50000:
-            # Duplicate the object to apply a wireframe modifier for visual distinction of edges.
+            # Collect the mesh for the wireframe, for visual distinction of edges.
             # only do this for smaller objects.
-            bpy.ops.object.duplicate()
-            bpy.ops.object.modifier_add(type="WIREFRAME")
+            verts[:, 2] = uv_object.location.z
+            wire_verts.append(verts)
+            wire_starts.append(starts + wire_vert_count)
+            wire_totals.append(totals)
+            wire_vert_count += len(verts)
+
+    if wire_verts:
+        # One mesh with one wireframe modifier for all the small UV meshes,
+        # instead of a modified duplicate per object.
+        wire_mesh = bpy.data.meshes.new("UVMesh_wire")
+        wire_mesh.from_pydata(
+            numpy.concatenate(wire_verts),
+            [],
+            loop_faces(numpy.concatenate(wire_starts), numpy.concatenate(wire_totals)),
+        )
+        wire_mesh.materials.append(m)
+        wire_object = bpy.data.objects.new("UVMesh_wire", wire_mesh)
+        scene.collection.objects.link(wire_object)
+        wireframe = wire_object.modifiers.new(name="Wireframe", type="WIREFRAME")
 
-            # Adjust the wireframe modifier to make the lines very thin.
-            bpy.context.object.modifiers["Wireframe"].thickness = 0.001
+        # Adjust the wireframe modifier to make the lines very thin.
+        wireframe.thickness = 0.001
+
+    # Update the depsgraph once for all the new objects.
+    bpy.context.view_layer.update()
@@ -10,15 +10,54 @@
 # The script is intended to be used in Blender's scripting environment.
 
 import bpy
-import bmesh
 from mathutils import *
+import concurrent.futures
+import math
+import numpy
 import os
 import tempfile
+from . import image_utils
 from . import utils
 from . import render_UVs
+# the scene used for node visualizations, kept between calls so render setup isn't repeated for every node tree
+visualization_scene = None
+
+
+def clear_scene_objects(scene):
+    # removes all objects of the scene, and their meshes, curves and cameras once nothing else uses them,
+    # so repeated visualizations don't pile up orphan data
+    object_data = {}
+    for obj in list(scene.collection.objects):
+        if obj.data is not None:
+            object_data[obj.data.as_pointer()] = obj.data
+        bpy.data.objects.remove(obj, do_unlink=True)
+    for data in object_data.values():
+        if data.users > 0:
+            continue
+        if isinstance(data, bpy.types.Mesh):
+            bpy.data.meshes.remove(data)
+        elif isinstance(data, bpy.types.Curve):
+            bpy.data.curves.remove(data)
+        elif isinstance(data, bpy.types.Camera):
+            bpy.data.cameras.remove(data)
+
+
 def setup_scene(material_name):
-    # Create a new scene with a clear name indicating it's for visualizing material nodes
-    new_scene = bpy.data.scenes.new(name=f"{material_name}_Node_Visualization")
+    global visualization_scene
+    new_scene = visualization_scene
+    if new_scene is not None:
+        try:
+            # Clear what the previous visualization left in the scene
+            clear_scene_objects(new_scene)
+        except ReferenceError:
+            # the scene was removed or another file was loaded
+            new_scene = None
+    if new_scene is None:
+        # Create a new scene for visualizing material nodes
+        new_scene = bpy.data.scenes.new(name="Node_Visualization")
+        visualization_scene = new_scene
+    # Name the scene clearly after what it visualizes
+    new_scene.name = f"{material_name}_Node_Visualization"
     bpy.context.window.scene = new_scene
     # Add background
     # bpy.ops.mesh.primitive_plane_add(size=100, location=(0, 0, -1))
@@ -26,10 +65,10 @@ def setup_scene(material_name):
     # bpy.context.object.data.materials.append(bpy.data.materials["Grey"])
 
     # Add an orthographic camera and name it properly
-    bpy.ops.object.camera_add(location=(0, 0, 10))
-    camera = bpy.context.object
-    camera.name = f"{material_name}_Visualization_Camera"
-    camera.data.name = f"{material_name}_Visualization_Camera_Data"
+    camera_data = bpy.data.cameras.new(name=f"{material_name}_Visualization_Camera_Data")
+    camera = bpy.data.objects.new(name=f"{material_name}_Visualization_Camera", object_data=camera_data)
+    new_scene.collection.objects.link(camera)
+    camera.location = (0, 0, 10)
     camera.rotation_euler = (0, 0, 0)
     camera.data.type = 'ORTHO'
     new_scene.camera = camera
@@ -40,6 +79,77 @@ line_height = 0.3
 text_scale = 0.2
 line_scale = 2 * text_scale
 margin = 0.1
+# size of the longer side of the rendered node graph
+max_render_size = 2048
+# space above the nodes for the material name
+title_height = 0.8
+
+# emission materials used by the visualization, name: color with alpha
+emit_material_colors = {
+    "Black": (0, 0, 0, 1),
+    "Grey": (0.5, 0.5, 0.5, 1),
+    "White": (.9, .9, .9, 1),
+    "Orange": (.7, 0.35, 0, 1),
+    "LightBlue": (0.2, 1, .8, 1),
+    "DarkGrey": (0.04, 0.04, 0.04, 0.8),
+    "Red": (1, .8, .8, 1),
+}
+# the materials created by visualize_nodes, by name, so drawing doesn't have to search bpy.data.materials
+emit_materials = {}
+
+def rounded_rect_outline(width, height, radius, segments, offset_x=0, offset_y=0):
+    # counter-clockwise outline of a rectangle spanning (0, 0) to (width, -height) with rounded corners
+    angles = numpy.linspace(0, math.pi / 2, segments + 1)
+    # corner arc centers and start angles: top left, bottom left, bottom right, top right
+    centers = numpy.array([(radius, -radius), (radius, radius - height),
+                           (width - radius, radius - height), (width - radius, -radius)])
+    starts = numpy.array([math.pi / 2, math.pi, 3 * math.pi / 2, 0])
+    a = starts[:, None] + angles[None, :]
+    coords = numpy.zeros((a.size, 3), dtype=numpy.float32)
+    coords[:, 0] = (centers[:, 0, None] + radius * numpy.cos(a)).ravel() + offset_x
+    coords[:, 1] = (centers[:, 1, None] + radius * numpy.sin(a)).ravel() + offset_y
+    return coords
+
+
+def node_card_geometry(width, height, bevel=0.2, inset=0.02, segments=10):
+    # Geometry of a node plane - rounded rectangle, with an inset border ring.
+    # Returns vertices, faces and material indices (0 for the inner face, 1 for the border).
+    radius = min(bevel, width / 2, height / 2)
+    outer = rounded_rect_outline(width, height, radius, segments)
+    inner = rounded_rect_outline(width - 2 * inset, height - 2 * inset, max(radius - inset, 0), segments,
+                                 offset_x=inset, offset_y=-inset)
+    n = len(outer)
+    i = numpy.arange(n)
+    j = (i + 1) % n
+    # border ring quads, outer vertices come first, inner ones after them
+    faces = numpy.stack((i, j, j + n, i + n), axis=1).tolist()
+    faces.append(list(range(n, 2 * n)))
+    material_indices = numpy.ones(n + 1, dtype=numpy.int32)
+    material_indices[-1] = 0
+    return numpy.concatenate((outer, inner)), faces, material_indices
+
+
+# text curves of the current visualization by (body, size, alignment, material), objects with the same text share them
+text_curves = {}
+
+
+def add_text_object(name, body, location, size, alignment_x, alignment_y, material, scene):
+    # creates a text object through bpy.data, without the context and scene update of the text_add operator
+    key = (body, size, alignment_x, alignment_y, material.as_pointer())
+    text_data = text_curves.get(key)
+    if text_data is None:
+        text_data = bpy.data.curves.new(name=f"{name}_Data", type='FONT')
+        text_data.body = body
+        text_data.align_x = alignment_x
+        text_data.align_y = alignment_y
+        text_data.size = size
+        text_data.materials.append(material)
+        text_curves[key] = text_data
+    text_obj = bpy.data.objects.new(name=name, object_data=text_data)
+    text_obj.location = location
+    scene.collection.objects.link(text_obj)
+    return text_obj
+
 
 class NodeRow():
     def __init__(self, textobject, text, position, type = 'input'):
@@ -48,46 +158,6 @@ class NodeRow():
         self.text = text
         self.position = position
 class drawNode:
-    def create_node_mesh(self):
-        # Create a plane for each node and name it accordingly
-        self.mesh = bpy.data.meshes.new(name=f"{self.node.name}_Plane")
-        self.plane_obj = bpy.data.objects.new(name=f"{self.node.name}_Plane_Obj", object_data=self.mesh)
-        self.scene.collection.objects.link(self.plane_obj)
-        bpy.context.view_layer.objects.active = self.plane_obj
-        self.plane_obj.location = self.position
-        self.bm = bmesh.new()
-        self.bm.verts.new((0, 0, 0))
-        self.bm.verts.new((0, -self.node_height, 0))
-        self.bm.verts.new((self.node_width, -self.node_height, 0))
-        self.bm.verts.new((self.node_width, 0, 0))
-        self.bm.faces.new(self.bm.verts)
-        self.bm.to_mesh(self.mesh)
-        self.bm.free()
-        # add bevel modifier with vertex option to make the edges round
-        bpy.ops.object.modifier_add(type='BEVEL')
-        bpy.context.object.modifiers["Bevel"].width = 0.2
-        bpy.context.object.modifiers["Bevel"].segments = 10
-        bpy.context.object.modifiers["Bevel"].affect = 'VERTICES'
-        # assign material
-        self.plane_obj.data.materials.append(bpy.data.materials["DarkGrey"])
-
-        # Apply bevel modifier, go to edit mode, slect all, inset by 0.1, invert selection, assign a new material slot and assign it to orange
-        bpy.ops.object.modifier_apply(modifier="Bevel")
-        bpy.ops.object.mode_set(mode='EDIT')
-        bpy.ops.mesh.select_all(action='SELECT')
-        # set selection to faces
-        bpy.ops.mesh.select_mode(type="FACE")
-        bpy.ops.mesh.inset(thickness=0.02, depth=0)
-        # invert selection
-        bpy.ops.mesh.select_all(action='INVERT')
-        # assign a new material slot
-        bpy.ops.object.material_slot_add()
-        # assign it to orange
-        bpy.context.object.active_material_index = 1
-        bpy.context.object.active_material = bpy.data.materials["Orange"]
-        bpy.ops.object.material_slot_assign()
-        bpy.ops.object.mode_set(mode='OBJECT')
-
     def count_used_inputs(self):
         i=0
         for input in self.node.inputs:
@@ -112,6 +182,8 @@ class drawNode:
         self.offs_x = 0
         self.offs_y = 0
         self.rows = []
+        # link positions of the rows, keyed by (socket identifier, row type)
+        self.socket_positions = {}
         if node.parent is not None:
             self.offs_x = node.parent.location.x
             self.offs_y = node.parent.location.y
@@ -163,14 +235,7 @@ class drawNode:
 
         # count inputs with links
         self.node_height = (len(self.rows)) * line_height
-
-        # create the mesh in the end, since we need to know how many rows are there.
-        self.create_node_mesh()
-
-        # parent the text objects to the node
-        for row in self.rows:
-            row.textobject.parent = self.plane_obj
-            # row.textobject.location = row.position
+        # the plane is created for all nodes at once in add_node_planes, since we need to know how many rows are there.
 
     def add_text(self, text, value=None, alignment_x='LEFT', alignment_y='TOP', size=0.3, color = 'White', type = 'input'):
         """
@@ -187,103 +252,153 @@ class drawNode:
             link_x = self.node_width
         y = - len(self.rows) * line_height
         link_y = y - line_height * 0.35
-        bpy.ops.object.text_add(location=(x , y, 0.05))
-        text_obj = bpy.context.object
         text_name = f"{self.node.name}_{text.replace(' ', '_')}"
-        text_obj.name = text_name
-        text_obj.data.name = f"{text_name}_Data"
-        text_obj.data.body = text
-        text_obj.data.align_x = alignment_x
-        text_obj.data.align_y = alignment_y
-        text_obj.data.size = size
+        # texts aren't parented to the node plane, so they are placed at the node position
+        text_obj = add_text_object(text_name, text, (self.position.x + x, self.position.y + y, 0.05), size,
+                                   alignment_x, alignment_y,
+                                   emit_materials[color], self.scene)
         # in case of non-empty value we want to add a right aligned value text object, that is parented to the main text object
         if value is not None:
-            bpy.ops.object.text_add(location=(self.node_width - margin, y, 0.05))
-            value_text_obj = bpy.context.object
-            value_text_name = f"{self.node.name}_{text.replace(' ', '_')}_Value"
-            value_text_obj.name = value_text_name
-            value_text_obj.data.name = f"{value_text_name}_Data"
-            value_text_obj.data.body = value
-            value_text_obj.data.align_x = 'RIGHT'
-            value_text_obj.data.align_y = alignment_y
-            value_text_obj.data.size = size
+            value_text_obj = add_text_object(f"{text_name}_Value", value,
+                                             (self.node_width - 2* margin , 0, 0.05), #position relative to the parent text..
+                                             size, 'RIGHT', alignment_y, emit_materials["Red"], self.scene)
             value_text_obj.parent = text_obj
-            value_text_obj.location = (self.node_width - 2* margin , 0, 0.05) #position relative to the parent text..
-            value_text_obj.data.materials.append(bpy.data.materials["Red"])
-        node_row = NodeRow(textobject = text_obj, text = text, position = Vector((link_x,link_y, -0.05)), type = type)
+        node_row = NodeRow(textobject = text_obj, text = text, position = (link_x, link_y, -0.05), type = type)
         self.rows.append(node_row)
-        # add material
-        text_obj.data.materials.append(bpy.data.materials[color])
+        self.socket_positions.setdefault((text, type), node_row.position)
 
         return node_row
 
-def draw_link(start_pos, end_pos, scene):
-    # Create a new curve
-    curve_data = bpy.data.curves.new('link_curve', type='CURVE')
-    curve_data.dimensions = '3D'
-    curve_data.fill_mode = 'FULL'
-    curve_data.bevel_depth = 0.02
-
-    # Add a new spline to the curve
+def add_node_planes(viz_nodes, scene):
+    # Creates one object with the planes of all nodes, instead of an object per node.
+    verts = []
+    faces = []
+    material_indices = []
+    # node planes of the same size share the geometry
+    geometry = {}
+    vert_count = 0
+    for viz_node in viz_nodes:
+        # Reroute has no plane
+        if viz_node.node.type == 'REROUTE':
+            continue
+        size = (viz_node.node_width, viz_node.node_height)
+        if size not in geometry:
+            # rounded rectangle with an inset border, built directly instead of bevel and inset operators
+            geometry[size] = node_card_geometry(*size)
+        node_verts, node_faces, node_material_indices = geometry[size]
+        verts.append(node_verts + numpy.array(viz_node.position, dtype=numpy.float32))
+        faces.extend([[i + vert_count for i in face] for face in node_faces])
+        material_indices.append(node_material_indices)
+        vert_count += len(node_verts)
+    if not verts:
+        return None
+
+    mesh = bpy.data.meshes.new(name="Node_Planes")
+    mesh.from_pydata(numpy.concatenate(verts), [], faces)
+    # assign materials, the border is orange
+    mesh.materials.append(emit_materials["DarkGrey"])
+    mesh.materials.append(emit_materials["Orange"])
+    mesh.polygons.foreach_set("material_index", numpy.concatenate(material_indices))
+    mesh.update()
+    planes_obj = bpy.data.objects.new(name="Node_Planes_Obj", object_data=mesh)
+    scene.collection.objects.link(planes_obj)
+    return planes_obj
+
+
+def uv_sphere_mesh(name, radius, segments=12, rings=8):
+    # low poly uv sphere mesh, shared by all the link end points
+    theta = numpy.linspace(0, math.pi, rings + 1)[1:-1]
+    phi = numpy.linspace(0, 2 * math.pi, segments, endpoint=False)
+    ring_verts = numpy.zeros((len(theta), segments, 3), dtype=numpy.float32)
+    ring_verts[:, :, 0] = radius * numpy.sin(theta)[:, None] * numpy.cos(phi)[None, :]
+    ring_verts[:, :, 1] = radius * numpy.sin(theta)[:, None] * numpy.sin(phi)[None, :]
+    ring_verts[:, :, 2] = radius * numpy.cos(theta)[:, None]
+    # ring vertices first, then the top and bottom pole
+    verts = numpy.concatenate((ring_verts.reshape(-1, 3), [(0, 0, radius), (0, 0, -radius)]))
+    top = len(verts) - 2
+    bottom = len(verts) - 1
+    i = numpy.arange(segments)
+    j = (i + 1) % segments
+    faces = numpy.stack((numpy.full(segments, top), i, j), axis=1).tolist()
+    for r in range(rings - 2):
+        a = r * segments
+        b = a + segments
+        faces += numpy.stack((a + i, b + i, b + j, a + j), axis=1).tolist()
+    last = (rings - 2) * segments
+    faces += numpy.stack((last + j, last + i, numpy.full(segments, bottom)), axis=1).tolist()
+    mesh = bpy.data.meshes.new(name)
+    mesh.from_pydata(verts, [], faces)
+    return mesh
+
+
+def draw_link(curve_data, start_pos, end_pos, scene, sphere_mesh):
+    # Add a new spline for the link to the shared links curve
     spline = curve_data.splines.new(type='BEZIER')
     spline.bezier_points.add(1)  # Two points total (start and end)
 
-    # Assign positions to the start and end points
-    spline.bezier_points[0].co = start_pos
-    spline.bezier_points[0].handle_right = start_pos+ Vector((.5, 0, 0))
-    spline.bezier_points[0].handle_left = start_pos - Vector((.5, 0, 0))
-    spline.bezier_points[1].co = end_pos
-    spline.bezier_points[1].handle_left = end_pos - Vector((.5, 0, 0))
-    spline.bezier_points[1].handle_right = end_pos + Vector((.5, 0, 0))
+    # Assign positions to the start and end points, handles are shifted horizontally
+    co = numpy.array((start_pos, end_pos), dtype=numpy.float32)
+    handle_offset = numpy.array((.5, 0, 0), dtype=numpy.float32)
+    spline.bezier_points.foreach_set("co", co.ravel())
+    spline.bezier_points.foreach_set("handle_left", (co - handle_offset).ravel())
+    spline.bezier_points.foreach_set("handle_right", (co + handle_offset).ravel())
 
-    # Create a new object with the curve
-    curve_obj = bpy.data.objects.new('Link', curve_data)
-    scene.collection.objects.link(curve_obj)
+    #add a small sphere at start and end, all of them share one mesh
+    for pos in (start_pos, end_pos):
+        sphere_obj = bpy.data.objects.new('LinkEnd', sphere_mesh)
+        sphere_obj.location = pos + Vector((0,0,0.1))
+        scene.collection.objects.link(sphere_obj)
+
+
+def visualize_links(node_tree, viz_nodes, scene, scale=0.01):
+    # all links are splines of one curve object
+    curve_data = bpy.data.curves.new('link_curve', type='CURVE')
+    curve_data.dimensions = '3D'
+    curve_data.fill_mode = 'FULL'
+    curve_data.bevel_depth = 0.02
     #set resolution of the curve to 25
-    curve_obj.data.resolution_u = 25
+    curve_data.resolution_u = 25
     #set material
-    curve_obj.data.materials.append(bpy.data.materials["Orange"])
-    #add a small sphere at start and end
-    bpy.ops.mesh.primitive_uv_sphere_add(radius=0.08, location=start_pos + Vector((0,0,0.1)))
-    bpy.context.object.data.materials.append(bpy.data.materials["Orange"])
-
-    bpy.ops.mesh.primitive_uv_sphere_add(radius=0.08, location=end_pos + Vector((0,0,0.1)))
-    bpy.context.object.data.materials.append(bpy.data.materials["Orange"])
+    curve_data.materials.append(emit_materials["Orange"])
+    curve_obj = bpy.data.objects.new('Links', curve_data)
+    scene.collection.objects.link(curve_obj)
 
-    return curve_obj
+    sphere_mesh = uv_sphere_mesh('LinkEnd', 0.08)
+    sphere_mesh.materials.append(emit_materials["Orange"])
+    # node names are unique in a node tree
+    viz_nodes_by_name = {n.node.name: n for n in viz_nodes}
 
+    def socket_position(viz_node, identifier, type):
+        # row positions are plain tuples relative to the node, one Vector is made for the link
+        row_position = viz_node.socket_positions.get((identifier, type))
+        if row_position is None:
+            return None
+        x, y, z = row_position
+        return Vector((viz_node.position.x + x, viz_node.position.y + y, viz_node.position.z + z))
 
-def visualize_links(node_tree, viz_nodes, scene, scale=0.01):
-    links = []
-    scale = 2
     for link in node_tree.links:
         # Find the corresponding visual nodes
-        from_viz_node = next((n for n in viz_nodes if n.node == link.from_node), None)
-        to_viz_node = next((n for n in viz_nodes if n.node == link.to_node), None)
+        from_viz_node = viz_nodes_by_name.get(link.from_node.name)
+        to_viz_node = viz_nodes_by_name.get(link.to_node.name)
 
         if from_viz_node and to_viz_node:
             # get positions from existing text rows
             if from_viz_node.node.type == 'REROUTE':
                 start_pos = from_viz_node.position
             else:
-                for row in from_viz_node.rows:
-                    if row.text == link.from_socket.identifier and row.type == 'output':
-                        start_pos = row.position + from_viz_node.position
-                        break
+                start_pos = socket_position(from_viz_node, link.from_socket.identifier, 'output')
+                if start_pos is None:
+                    continue
             if to_viz_node.node.type == 'REROUTE':
                 end_pos = to_viz_node.position
             else:
-                for row in to_viz_node.rows:
-                    if row.text == link.to_socket.identifier and row.type == 'input':
-                        end_pos = row.position + to_viz_node.position
-                        break
-
+                end_pos = socket_position(to_viz_node, link.to_socket.identifier, 'input')
+                if end_pos is None:
+                    continue
 
-            offset = Vector((0, - text_scale * line_scale *.5,0))
             # Draw the link
-            link_obj = draw_link(start_pos  , end_pos, scene)
-            links.append(link_obj)
-    return links
+            draw_link(curve_data, start_pos, end_pos, scene, sphere_mesh)
+    return curve_obj
 
 
 def create_emit_material(name, color = (1,1,1,1)):
@@ -291,8 +406,7 @@ def create_emit_material(name, color = (1,1,1,1)):
     mat.use_nodes = True
     nodes = mat.node_tree.nodes
     links = mat.node_tree.links
-    for n in nodes:
-        nodes.remove(n)
+    nodes.clear()  # Start with a fresh node setup.
     output = nodes.new("ShaderNodeOutputMaterial")
     output.location = (200,0)
     #emission node
@@ -314,37 +428,77 @@ def create_emit_material(name, color = (1,1,1,1)):
     links.new(mix.outputs[0], output.inputs[0])
     return mat
 
+def ensure_emit_materials():
+    # creates the visualization materials only if they don't exist yet from a previous visualization.
+    # not looked up by name in bpy.data.materials, the asset can have its own "White" or "Orange" material.
+    for mat_name, color in emit_material_colors.items():
+        mat = emit_materials.get(mat_name)
+        if mat is not None:
+            try:
+                mat.name
+                continue
+            except ReferenceError:
+                pass  # removed or another file was loaded
+        emit_materials[mat_name] = create_emit_material(mat_name, color)
+
+
+def set_render_settings(scene, resolution_x, resolution_y, filepath):
+    # set fast render settings for quick render with cycles
+    scene.render.engine = 'CYCLES'
+    scene.cycles.device = 'GPU'
+    scene.cycles.samples = 20
+    scene.cycles.use_denoising = False
+    # all materials are emission, only camera rays and transparency are needed
+    scene.cycles.max_bounces = 0
+    if bpy.app.version >= (3, 5, 0):
+        scene.cycles.use_light_tree = False
+
+    scene.render.resolution_x = resolution_x
+    scene.render.resolution_y = resolution_y
+    scene.render.resolution_percentage = 100
+    scene.render.image_settings.file_format = 'WEBP'
+    scene.render.image_settings.quality = 20
+
+    # set output path
+    scene.render.filepath = filepath
+
+
 def visualize_nodes(tempfolder,name, node_tree, scene):
     #this should be able to render material or geometry nodes, shading nodes e.t..c just anything.
 
-    black = create_emit_material("Black", (0, 0, 0, 1))
-    grey = create_emit_material("Grey", (0.5, 0.5, 0.5, 1))
-    white = create_emit_material("White", (.9, .9, .9, 1))
-    orange = create_emit_material("Orange", (.7, 0.35, 0, 1))
-    light_blue = create_emit_material("LightBlue", (0.2, 1, .8, 1))
-    dark_grey = create_emit_material("DarkGrey", (0.04, 0.04, 0.04, 0.8))
-    red = create_emit_material("Red", (1, .8, .8, 1))
+    ensure_emit_materials()
+    white = emit_materials["White"]
+    # curves of the previous visualization were removed with its objects
+    text_curves.clear()
 
     new_scene, camera = setup_scene(name)
 
-    min_x, max_x, min_y, max_y = (float('inf'), float('-inf'), float('inf'), float('-inf'))
-
     nodes = []
     for node in node_tree.nodes:
         if node.type == 'FRAME':
             continue
 
         viz_node = drawNode(node, new_scene)
-
         nodes.append(viz_node)
-        # Update bounds for camera
-        min_x = min(min_x, viz_node.position.x)
-        max_x = max(max_x, viz_node.position.x + viz_node.node_width)
-        min_y = min(min_y, viz_node.position.y)
-        max_y = max(max_y, viz_node.position.y - viz_node.node_height)
+    add_node_planes(nodes, new_scene)
+
+    if not nodes:
+        bpy.context.window.scene = scene
+        return
+
+    # Update bounds for camera, node positions are their top left corners
+    bounds = numpy.array([(n.position.x, n.position.y, n.node_width, n.node_height) for n in nodes])
+    min_x = bounds[:, 0].min()
+    max_x = (bounds[:, 0] + bounds[:, 2]).max()
+    min_y = (bounds[:, 1] - bounds[:, 3]).min()
+    max_y = bounds[:, 1].max()
 
     links = visualize_links(node_tree, nodes, new_scene)
 
+    # Add text object with material name in the upper left corner, above the nodes
+    max_y += title_height
+    add_text_object(f"{name}_Name", 'Material: ' + name, (min_x, max_y, 0), .6,
+                    'LEFT', 'TOP', white, new_scene)
 
     # Adjust the camera to cover all nodes and name it
     center_x = (min_x + max_x) / 2
@@ -354,89 +508,109 @@ def visualize_nodes(tempfolder,name, node_tree, scene):
 
     camera.location.x = center_x
     camera.location.y = center_y
+    # ortho scale covers the longer side, which also gets the longer side of the render
     camera.data.ortho_scale = max(width, height) * 1.1  # Adding some padding for better framing
 
-    # Add text object with material name in the upper left corner
-    max_corner = max(width, height)
-    bpy.ops.object.text_add(location=(center_x-max_corner/2, center_y+max_corner/2, 0))
-    text_obj = bpy.context.object
-    text_obj.name = f"{name}_Name"
-    text_obj.data.name = f"{name}_Name_Data"
-    text_obj.data.body = 'Material: ' + name
-    text_obj.data.align_x = 'LEFT'
-    text_obj.data.align_y = 'TOP'
-    text_obj.data.size = .6
-    text_obj.data.materials.append(white)
-
-    # set fast render settings for quick render with cycles
-    bpy.context.scene.render.engine = 'CYCLES'
-    bpy.context.scene.cycles.device = 'GPU'
-    bpy.context.scene.cycles.samples = 20
-    bpy.context.scene.cycles.use_denoising = False
-
-    # set output to square 1024x1024
-    bpy.context.scene.render.resolution_x = 2048
-    bpy.context.scene.render.resolution_y = 2048
-    bpy.context.scene.render.resolution_percentage = 100
-    bpy.context.scene.render.image_settings.file_format = 'WEBP'
-    bpy.context.scene.render.image_settings.quality = 20
-
-    # set output path
-    bpy.context.scene.render.filepath = os.path.join(tempfolder,
-                                                     f"Nodes_{name}")
+    # match the output aspect ratio to the graph, so no pixels are spent on empty space.
+    # sizes are multiples of 8, at least 256
+    if width >= height:
+        resolution_x = max_render_size
+        resolution_y = max_render_size * height / width
+    else:
+        resolution_x = max_render_size * width / height
+        resolution_y = max_render_size
+    set_render_settings(new_scene, max(256, int(round(resolution_x / 8)) * 8),
+                        max(256, int(round(resolution_y / 8)) * 8),
+                        os.path.join(tempfolder, f"Nodes_{name}"))
 
     # Render the scene
     bpy.ops.render.render(write_still=True)
 
-    # delete the scene
-    bpy.data.scenes.remove(new_scene)
+    # free the objects and their data, go back to the original scene,
+    # the visualization scene is kept for the next node tree
+    clear_scene_objects(new_scene)
+    bpy.context.window.scene = scene
 
 
 def visualize_material_nodes(material_name, tempfolder = None):
     # visualize all materials
     # make a copy of the materials, because we add some extra so that it does not mess up the original
 
-    if material_name not in bpy.data.materials:
+    material = bpy.data.materials.get(material_name)
+    if material is None:
         print(f"Material '{material_name}' not found.")
         return
-    material = bpy.data.materials[material_name]
     visualize_nodes(tempfolder, material_name, material.node_tree, bpy.context.scene)
 
-def visualize_all_nodes(tempfolder = None, objects = None):
-    # visualize all materials
-    # make a copy of the materials, because we add some extra so that it does not mess up the original
-    mts = []
+# object types that can have material slots
+material_object_types = ['MESH', 'CURVE', 'SURFACE', 'FONT', 'META', 'VOLUME']
+
+
+def scan_objects(objects):
+    """
+    Collects everything the exports need from the objects in one pass.
+    Returns a dict with unique 'materials', 'textures' (images of their image texture nodes),
+    'geometry_node_groups' and 'uv_mesh_objects' (one mesh object with uv layout per mesh data).
+    Datablocks are compared by pointer, python wrappers of the same datablock differ so id() can't be used.
+    """
+    scan = {'materials': [], 'textures': [], 'geometry_node_groups': [], 'uv_mesh_objects': []}
+    seen = set()
+
+    def add_unique(key, datablock):
+        # returns True if the datablock wasn't collected yet
+        pointer = datablock.as_pointer()
+        if pointer in seen:
+            return False
+        seen.add(pointer)
+        scan[key].append(datablock)
+        return True
+
     for ob in objects:
-        if ob.type in ['MESH', 'CURVE', 'SURFACE', 'FONT', 'META', 'VOLUME']:
+        if ob.type in material_object_types:
             for slot in ob.material_slots:
-                if slot.material is not None and slot.material not in mts:
-                    mts.append(slot.material)
+                if slot.material is not None and add_unique('materials', slot.material):
+                    if slot.material.node_tree is not None:
+                        for node in slot.material.node_tree.nodes:
+                            if node.type == 'TEX_IMAGE' and node.image is not None:
+                                add_unique('textures', node.image)
+        for modifier in ob.modifiers:
+            if modifier.type == 'NODES' and modifier.node_group is not None:
+                add_unique('geometry_node_groups', modifier.node_group)
+        #check if object is mesh and has uv layers
+        if ob.type == 'MESH' and len(ob.data.uv_layers) != 0 and ob.data.uv_layers.active is not None and len(
+                    ob.data.uv_layers.active.data) != 0:
+            mesh_pointer = ob.data.as_pointer()
+            if mesh_pointer not in seen:
+                seen.add(mesh_pointer)
+                scan['uv_mesh_objects'].append(ob)
+    return scan
+
 
-    for material in mts:
+def visualize_all_nodes(tempfolder = None, objects = None, scan = None):
+    # visualize all materials
+    # make a copy of the materials, because we add some extra so that it does not mess up the original
+    if scan is None:
+        scan = scan_objects(objects)
+
+    for material in scan['materials']:
         if material.use_nodes and material.node_tree is not None:
             visualize_nodes(tempfolder, material.name, material.node_tree, bpy.context.scene)
 
     # visualize all geometry nodes
-    gngroups=[]
-    for ob in objects:
-        for modifier in ob.modifiers:
-            if modifier.type == 'NODES':
-                if modifier.node_group not in gngroups:
-                    gngroups.append(modifier.node_group)
-
-    for geometry_nodes in gngroups:
+    for geometry_nodes in scan['geometry_node_groups']:
         if geometry_nodes.bl_idname == 'GeometryNodeTree':
             visualize_nodes(tempfolder, geometry_nodes.name, geometry_nodes, bpy.context.scene)
 
 
 def activate_object(aob):
     # this deselects everything, selects the object and makes it active
-    for obj in bpy.context.visible_objects:
+    # only the selected objects need deselecting, usually far fewer than all visible ones
+    for obj in list(bpy.context.view_layer.objects.selected):
         obj.select_set(False)
     aob.select_set(True)
     bpy.context.view_layer.objects.active = aob
 
-def save_uv_layouts(tempfolder, objects):
+def save_uv_layouts(tempfolder, objects, scan = None):
     # save uv layouts for all objects
     # select all objects
     for ob in objects:
@@ -448,17 +622,10 @@ def save_uv_layouts(tempfolder, objects):
             bpy.context.view_layer.objects.active = obj
             break
 
-    # select all
-    for ob in objects:
-        ob.select_set(True)
     # save uv layout
-    unique_meshes_obs = []
-    for obj in objects:
-        #check if object is mesh and has uv layers
-        if obj.type == 'MESH' and len(ob.data.uv_layers) != 0 and obj.data.uv_layers.active is not None and len(
-                    ob.data.uv_layers.active.data) != 0:
-            if obj.data not in [o.data for o in unique_meshes_obs]:
-                unique_meshes_obs.append(obj)
+    if scan is None:
+        scan = scan_objects(objects)
+    unique_meshes_obs = scan['uv_mesh_objects']
     # No UV = no svg
     if len(unique_meshes_obs) == 0:
         return
@@ -486,60 +653,61 @@ def save_uv_layouts(tempfolder, objects):
         # let's use the render_UVs instead of the built-in operator
         render_UVs.export_uvs_as_webps([obj], filepath)
 
-def export_all_textures(tempfolder, objects):
+def export_textures(tempfolder, unique_textures):
+    # export textures as webp with very low quality setting.
+    # 8 bit images that need no color management are read here and encoded by Pillow in worker threads,
+    # the encoder releases the GIL. save_render can't run outside the main thread.
+    # set to webp with very low quality setting for export...
+    bpy.context.scene.render.image_settings.file_format = 'WEBP'
+    use_alpha = bpy.context.scene.render.image_settings.color_mode == 'RGBA'
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1)) as executor:
+        futures = []
+        for img in unique_textures:
+            quality = 20
+            #if name of texture contains normal, set it a bit higher
+            if 'normal' in img.name.lower():
+                quality = 60
+            filepath = bpy.path.ensure_ext(os.path.join(tempfolder, f"TEXTURE_{img.name}"), ".webp")
+            # scale down textures larger than 2048
+            if image_utils.can_save_without_color_management(img):
+                # downscaled while reading, so the image in the file stays untouched
+                pixels = image_utils.image_to_uint8(img, max_size=2048)
+                futures.append(executor.submit(image_utils.save_uint8_as_webp, pixels,
+                                               bpy.path.abspath(filepath), quality, use_alpha))
+            else:
+                if img.size[0] > 2048 or img.size[1] > 2048:
+                    scale = 2048 / max(img.size[0], img.size[1])
+                    img.scale(round(img.size[0] * scale), round(img.size[1] * scale))
+                img.save_render(filepath=filepath, quality=quality)
+        # raise encoding errors here
+        for future in futures:
+            future.result()
+
+def export_all_textures(tempfolder, objects, scan = None):
     # export all textures
-    unique_textures = []
-    for ob in objects:
-        if ob.type in ['MESH', 'CURVE', 'SURFACE', 'FONT', 'META', 'VOLUME']:
-            for slot in ob.material_slots:
-                if slot.material is not None:
-                    for node in slot.material.node_tree.nodes:
-                        if node.type == 'TEX_IMAGE':
-                            img = node.image
-                            if img is not None:
-                                if img not in unique_textures:
-                                    unique_textures.append(img)
-    for img in unique_textures:
-        # set to webp with very low quality setting for export...
-        bpy.context.scene.render.image_settings.file_format = 'WEBP'
-        quality = 20
-        #if name of texture contains normal, set it a bit higher
-        if 'normal' in img.name.lower():
-            quality = 60
-        filepath = os.path.join(tempfolder, f"TEXTURE_{img.name}")
-        # scale down textures larger than 2048
-        if img.size[0] > 2048 or img.size[1] > 2048:
-            scale = 2048 / max(img.size[0], img.size[1])
-            img.scale(round(img.size[0] * scale), round(img.size[1] * scale))
-        img.save_render(filepath=bpy.path.ensure_ext(filepath, ".webp"), quality=quality)
+    if scan is None:
+        scan = scan_objects(objects)
+    export_textures(tempfolder, scan['textures'])
 
 def export_all_material_textures(tempfolder, material):
     # export all textures
     unique_textures = []
+    seen_textures = set()
     for node in material.node_tree.nodes:
         if node.type == 'TEX_IMAGE':
             img = node.image
             if img is not None:
-                if img not in unique_textures:
+                if img.as_pointer() not in seen_textures:
+                    seen_textures.add(img.as_pointer())
                     unique_textures.append(img)
-    for img in unique_textures:
-        # set to webp with very low quality setting for export...
-        bpy.context.scene.render.image_settings.file_format = 'WEBP'
-        quality = 20
-        # if name of texture contains normal, set it a bit higher
-        if 'normal' in img.name.lower():
-            quality = 60
-        filepath = os.path.join(tempfolder, f"TEXTURE_{img.name}")
-        # scale down textures larger than 2048
-        if img.size[0] > 2048 or img.size[1] > 2048:
-            scale = 2048 / max(img.size[0], img.size[1])
-            img.scale(round(img.size[0] * scale), round(img.size[1] * scale))
-        img.save_render(filepath=bpy.path.ensure_ext(filepath, ".webp"), quality=quality)
+    export_textures(tempfolder, unique_textures)
 
 def visualize_and_save_all(tempfolder, objects):
+    # collect materials, textures, node groups and uv meshes once for all the exports
+    scan = scan_objects(objects)
     # first let's save all textures
-    export_all_textures(tempfolder, objects)
+    export_all_textures(tempfolder, objects, scan=scan)
     # save uv layouts
-    save_uv_layouts(tempfolder, objects)
+    save_uv_layouts(tempfolder, objects, scan=scan)
     # visualize all nodes
-    visualize_all_nodes(tempfolder, objects)
+    visualize_all_nodes(tempfolder, objects, scan=scan)
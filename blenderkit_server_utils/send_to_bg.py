@@ -1,3 +1,4 @@
+import functools
 import json
 import os
 import subprocess
@@ -17,6 +18,16 @@ def version_to_float(version):
 
 def get_blender_version_from_blend(blend_file_path):
     # get blender version from blend file, works only for 2.8+
+    # results are cached per file path, modification time and size, so re-processing
+    # the same file doesn't reopen it
+    st = os.stat(blend_file_path)
+    return _read_blender_version_from_blend(
+        os.path.abspath(blend_file_path), st.st_mtime_ns, st.st_size
+    )
+
+
+@functools.lru_cache(maxsize=1024)
+def _read_blender_version_from_blend(blend_file_path, mtime_ns, size):
     with open(blend_file_path, "rb") as blend_file:
         # Read the first 12 bytes
         header = blend_file.read(24)